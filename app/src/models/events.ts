@@ -6,4 +6,5 @@ export interface Event {
 	end: number;
 	location_lat: number;
 	location_lon: number;
+	version: number;
 }
\ No newline at end of file
@@ -1,17 +1,83 @@
-from server.user import UsersSlay
-from dataclasses import dataclass
 """
-initialize friend list for each user
+friendships between users
 
-user requests someone else
+a user requests someone else, who can accept (by requesting back) or decline. either of
+them can remove the friendship later. see migrations/010 for how the edges are stored
+"""
+from db import get_db
 
-user receives request
-- choose whether to accept or not
 
-saves user friend list
+class Friends(object):
 
-removes friend?
+    @staticmethod
+    def get(username: str):
+        """ usernames username is friends with """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("SELECT friend FROM friendEdges WHERE username = ? AND status = 'friends'", [username])
+            return [row[0] for row in cur.fetchall()]
 
-"""
+    @staticmethod
+    def status(username: str, other: str):
+        """ 'friends', 'requested' (username asked other), 'incoming' (other asked username) or None """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("SELECT status FROM friendEdges WHERE username = ? AND friend = ?", [username, other])
+            res = cur.fetchone()
+        return res[0] if res is not None else None
+
+    @staticmethod
+    def request(username: str, other: str):
+        """ username asks to be friends with other, or accepts if other already asked. returns the new status """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("SELECT status FROM friendEdges WHERE username = ? AND friend = ?", [username, other])
+            res = cur.fetchone()
+            if res is None:
+                cur.execute("INSERT OR IGNORE INTO friendEdges (username, friend, status) VALUES (?, ?, 'requested'), (?, ?, 'incoming')",
+                            [username, other, other, username])
+                return 'requested'
+            if res[0] == 'incoming':
+                cur.execute("UPDATE friendEdges SET status = 'friends' WHERE (username = ? AND friend = ?) OR (username = ? AND friend = ?)",
+                            [username, other, other, username])
+                return 'friends'
+            return res[0]
+
+    @staticmethod
+    def remove(username: str, other: str):
+        """ unfriend, or cancel/decline a request, whichever it is """
+        with get_db() as con:
+            con.execute("DELETE FROM friendEdges WHERE (username = ? AND friend = ?) OR (username = ? AND friend = ?)",
+                        [username, other, other, username])
+
+    @staticmethod
+    def requests(username: str):
+        """ {'incoming': [...], 'outgoing': [...]} pending requests """
+        pending = {'incoming': [], 'outgoing': []}
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("SELECT friend, status FROM friendEdges WHERE username = ? AND status != 'friends'", [username])
+            for friend, status in cur.fetchall():
+                pending['incoming' if status == 'incoming' else 'outgoing'].append(friend)
+        return pending
 
+    @staticmethod
+    def mutual(username: str, other: str):
+        """ friends username and other have in common """
+        return sorted(set(Friends.get(username)) & set(Friends.get(other)))
 
+    @staticmethod
+    def suggestions(username: str, limit: int = 20):
+        """ [(username, mutual friend count)] friends of friends username isn't already
+        connected to, most mutual friends first """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("SELECT friend FROM friendEdges WHERE username = ?", [username])
+            known = {row[0] for row in cur.fetchall()}
+            known.add(username)
+            # the friends of each of username's friends, off the primary key
+            cur.execute("SELECT theirs.friend, COUNT(*) FROM friendEdges AS mine JOIN friendEdges AS theirs ON theirs.username = mine.friend WHERE mine.username = ? AND mine.status = 'friends' AND theirs.status = 'friends' GROUP BY theirs.friend",
+                        [username])
+            candidates = [(friend, count) for friend, count in cur.fetchall() if friend not in known]
+        candidates.sort(key=lambda candidate: (-candidate[1], candidate[0]))
+        return candidates[:limit]
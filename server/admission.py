@@ -0,0 +1,168 @@
+"""
+admission control: turn requests away straight away, with a Retry-After, rather than let
+them queue up behind each other. every /api request takes a token from its client
+address's bucket and, when logged in, from the user's (uploads take UPLOAD_COST), and an
+empty bucket is a 429. uploads also need a place under a global cap on how many can be in
+flight and how many bytes they add up to, and get a 503 when there isn't one
+"""
+import collections
+import math
+import os
+import threading
+import time
+
+# set ADMISSION_ENABLED=0 to let everything in
+ENABLED = os.environ.get("ADMISSION_ENABLED", "1") != "0"
+# requests per second, and how many can come at once, per client address and per user
+IP_RATE = float(os.environ.get("IP_RATE", "50"))
+IP_BURST = float(os.environ.get("IP_BURST", "200"))
+USER_RATE = float(os.environ.get("USER_RATE", "20"))
+USER_BURST = float(os.environ.get("USER_BURST", "100"))
+# tokens an upload takes
+UPLOAD_COST = float(os.environ.get("UPLOAD_COST", "10"))
+# uploads being received or stored at once, and their bytes between them
+MAX_UPLOADS = int(os.environ.get("MAX_UPLOADS", "4"))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+# proxies in front of the server that add X-Forwarded-For, 0 to use the peer address as is.
+# behind a proxy without this every request looks like it comes from the proxy
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "0"))
+# buckets kept per kind, the least recently used are dropped past this
+MAX_BUCKETS = 100_000
+# bodies bigger than this count as uploads whatever their type (old clients send base64 json)
+UPLOAD_THRESHOLD = 64 * 1024
+# where asgi.py notes that it's already admitted a request's upload
+ENVIRON_KEY = "admission.upload"
+
+
+class Rejected(Exception):
+	""" turned away, try again in retry_after seconds """
+
+	def __init__(self, retry_after: float):
+		super().__init__(retry_after)
+		self.retry_after = retry_after
+
+	def retry_after_header(self) -> str:
+		return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimited(Rejected):
+	""" this client or user is over its rate (429) """
+
+
+class Overloaded(Rejected):
+	""" too many uploads in flight (503) """
+
+
+class TokenBucket(object):
+	""" holds up to burst tokens, refilled at rate per second """
+	__slots__ = ("rate", "burst", "tokens", "updated")
+
+	def __init__(self, rate: float, burst: float):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+
+	def take(self, cost: float = 1) -> float:
+		""" take cost tokens and return 0, or if there aren't enough, take none and return
+		the seconds until there will be """
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		if self.tokens >= cost:
+			self.tokens -= cost
+			return 0
+		return (min(cost, self.burst) - self.tokens) / self.rate
+
+
+class Buckets(object):
+	""" a token bucket per key, made full on first use """
+
+	def __init__(self, rate: float, burst: float, maxsize: int = MAX_BUCKETS):
+		self.rate = rate
+		self.burst = burst
+		self.maxsize = maxsize
+		self._buckets = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def take(self, key, cost: float = 1) -> float:
+		with self._lock:
+			bucket = self._buckets.get(key)
+			if bucket is None:
+				bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+				if len(self._buckets) > self.maxsize:
+					self._buckets.popitem(last=False)
+			else:
+				self._buckets.move_to_end(key)
+			return bucket.take(cost)
+
+
+class UploadGate(object):
+	""" at most max_uploads at once and max_bytes between them. one upload is always let
+	in, however big, so one bigger than max_bytes isn't turned away forever """
+
+	def __init__(self, max_uploads: int, max_bytes: int):
+		self.max_uploads = max_uploads
+		self.max_bytes = max_bytes
+		self.uploads = 0
+		self.bytes = 0
+		self._lock = threading.Lock()
+
+	def enter(self, size: int) -> bool:
+		with self._lock:
+			if self.uploads and (self.uploads >= self.max_uploads or self.bytes + size > self.max_bytes):
+				return False
+			self.uploads += 1
+			self.bytes += size
+			return True
+
+	def leave(self, size: int):
+		with self._lock:
+			self.uploads -= 1
+			self.bytes -= size
+
+
+_ips = Buckets(IP_RATE, IP_BURST)
+_users = Buckets(USER_RATE, USER_BURST)
+_uploads = UploadGate(MAX_UPLOADS, MAX_UPLOAD_BYTES)
+
+
+def upload_size(method: str, mimetype: str, content_length: int, limit: int):
+	""" the bytes an upload counts for against MAX_UPLOAD_BYTES (limit if the body has no
+	length), or None if the request isn't an upload """
+	if method not in ("POST", "PUT"):
+		return None
+	if not (mimetype.startswith("image/") or mimetype == "multipart/form-data" or (content_length or 0) > UPLOAD_THRESHOLD):
+		return None
+	return content_length if content_length is not None else limit
+
+
+def client_address(peer: str, forwarded: str = None) -> str:
+	""" the address to limit a request by: the one TRUSTED_PROXIES in from the right of
+	X-Forwarded-For, the way ProxyFix picks it for flask, else the peer's """
+	if TRUSTED_PROXIES and forwarded:
+		values = [value.strip() for value in forwarded.split(",")]
+		if len(values) >= TRUSTED_PROXIES:
+			return values[-TRUSTED_PROXIES]
+	return peer
+
+
+def check(ip: str, username: str = None, cost: float = 1):
+	""" take cost tokens from the address's bucket and the user's, or raise RateLimited.
+	ip is None when the address has been charged already """
+	wait = _ips.take(ip, cost) if ip is not None else 0
+	if not wait and username is not None:
+		wait = _users.take(username, cost)
+	if wait:
+		raise RateLimited(wait)
+
+
+def start_upload(size: int):
+	""" take a place for an upload of size bytes, or raise Overloaded. finish_upload(size)
+	gives it back """
+	if not _uploads.enter(size):
+		raise Overloaded(1)
+
+
+def finish_upload(size: int):
+	_uploads.leave(size)
@@ -1,25 +1,180 @@
 #!/usr/bin/env python3
 import json
 import base64
+import hashlib
 
-from flask import Flask, request, session, send_from_directory, Response
+from flask import Flask, g, request, session, send_file, stream_with_context, Response
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dataclasses import dataclass
-from db import get_db
+from db import get_db, release_db
+from migrate import migrate
 from user import UsersSlay
-import bcrypt
+from Friends import Friends
+import passwords
 import os.path
 from events import Events
+import events
+import ics
+import admission
+import assets
+import blobs
+import images
+import cache
+import search
+import pubsub
+import metrics
+import maintenance
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
 
 
-app = Flask(__name__, static_folder=os.path.abspath("../public"))
-app.secret_key = b'github dot com'
+# public/ is served from memory by serve_public, see assets.py
+app = Flask(__name__, static_folder=None)
+# sessions are signed with this, so every process serving the app has to have the same one
+if os.environ.get("SECRET_KEY"):
+    app.secret_key = os.environ["SECRET_KEY"].encode()
+else:
+    logging.warning("SECRET_KEY isn't set, using a random one: sessions won't survive a restart")
+    app.secret_key = os.urandom(32)
+app.teardown_appcontext(release_db)
+
+# biggest photo/pfp we'll take, in bytes
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 20 * 1024 * 1024))
+# leave room for old clients that still send the image base64'd inside json
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE * 4 // 3 + 64 * 1024
+
+migrate()
+release_db()
+maintenance.start()
+
+if metrics.ENABLED:
+    @app.before_request
+    def start_metrics():
+        metrics.start_request()
+
+    @app.after_request
+    def record_metrics(res):
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.finish_request(request.method, route, res.status_code, res.content_length)
+        return res
+
+if admission.TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=admission.TRUSTED_PROXIES)
+
+if admission.ENABLED:
+    @app.before_request
+    def admit():
+        """ rate limit /api by client address and user, and cap the uploads in flight.
+        asgi.py has already charged the address for an upload it read the body of, and
+        let it in """
+        if not request.path.startswith("/api/"):
+            return
+        upload = admission.upload_size(request.method, request.mimetype, request.content_length, app.config['MAX_CONTENT_LENGTH'])
+        admitted = admission.ENVIRON_KEY in request.environ
+        admission.check(None if admitted else request.remote_addr, session.get('username'),
+                        admission.UPLOAD_COST if upload is not None else 1)
+        if upload is not None and not admitted:
+            admission.start_upload(upload)
+            g.upload = upload
+
+    @app.teardown_request
+    def finish_upload(exc):
+        if 'upload' in g:
+            admission.finish_upload(g.pop('upload'))
 
 def error(message):
     return json.dumps({"error": message})
 
+@app.errorhandler(blobs.TooLarge)
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return error(f"uploads can be at most {MAX_UPLOAD_SIZE} bytes"), 413
+
+@app.errorhandler(admission.RateLimited)
+def rate_limited(e):
+    return error("too many requests, slow down"), 429, {"Retry-After": e.retry_after_header()}
+
+@app.errorhandler(admission.Overloaded)
+def uploads_overloaded(e):
+    return error("too many uploads right now, try again in a moment"), 503, {"Retry-After": e.retry_after_header()}
+
+@app.errorhandler(passwords.Overloaded)
+def passwords_overloaded(e):
+    return error("too many logins right now, try again in a moment"), 503, {"Retry-After": "1"}
+
+# photo and pfp ids always point at the same bytes, so those urls can be cached forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def not_modified(etag, cache_control):
+    """ a 304 if the client's If-None-Match already has etag, otherwise None """
+    if not request.if_none_match.contains(etag):
+        return None
+    res = Response(status=304)
+    res.set_etag(etag)
+    res.headers['Cache-Control'] = cache_control
+    return res
+
+def cached_json(etag, make_body, cache_control="no-cache"):
+    """ make_body() as json with an etag, or a 304 without calling make_body if the client has it """
+    res = not_modified(etag, cache_control)
+    if res is None:
+        res = Response(make_body(), mimetype="application/json")
+        res.set_etag(etag)
+        res.headers['Cache-Control'] = cache_control
+    return res
+
+def send_blob(hash, immutable=False):
+    """ send a photo or pfp. ?size=thumb (or another of images.SIZES) sends the resized
+    copy instead, or the original if that copy is still being made. the etag is the
+    blob's hash, so a 304 never has to open the file """
+    size = request.args.get('size')
+    if size is not None and size not in images.SIZES:
+        return error("unknown size")
+    etag = hash if size is None else f"{hash}-{size}"
+    cache_control = IMMUTABLE if immutable else "no-cache"
+
+    res = not_modified(etag, cache_control)
+    if res is not None:
+        return res
+    if size is None:
+        res = send_file(blobs.path(hash), mimetype=images.mimetype(hash), etag=etag)
+    else:
+        variant = images.get_variant(hash, size)
+        if variant is not None:
+            res = send_file(variant[0], mimetype=variant[1], etag=etag)
+        else:
+            # don't let the original get cached as the resized copy
+            res = send_file(blobs.path(hash), mimetype=images.mimetype(hash), etag=hash)
+            cache_control = "no-cache"
+    res.headers['Cache-Control'] = cache_control
+    return res
+
+def upload():
+    """ put the image in the request body into the blob store and return (hash, size),
+    or None if there isn't one. the body can be the raw image (content-type image/*),
+    a multipart form with a `data` file, or json {"data": <base64>} like old clients send.
+    the first two are streamed to disk, never read into memory whole """
+    if request.content_length is not None and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        raise blobs.TooLarge()
+    if request.mimetype.startswith("image/"):
+        if request.content_length is not None and request.content_length > MAX_UPLOAD_SIZE:
+            raise blobs.TooLarge()
+        hash, size = blobs.put_stream(request.stream, MAX_UPLOAD_SIZE)
+        return (hash, size) if size > 0 else None
+    if request.mimetype == "multipart/form-data":
+        file = request.files.get('data')
+        if file is None:
+            return None
+        return blobs.put_stream(file.stream, MAX_UPLOAD_SIZE)
+    if request.is_json and 'data' in request.json:
+        data = base64.b64decode(request.json['data'])
+        if len(data) > MAX_UPLOAD_SIZE:
+            raise blobs.TooLarge()
+        return blobs.put(data), len(data)
+    return None
+
 @app.route("/api/user/me", methods = ['GET'])
 def get_me():
     if 'username' not in session:
@@ -31,93 +186,116 @@ def get_user(username):
     """ get the user from the database """
     user = UsersSlay.get(username)
     if user is not None:
-        return json.dumps({
-            'username': user.username,
-            'name': user.name,
-            'pronouns': user.pronouns,
-            'bio': user.bio,
-            'age': user.age,
-            'year': user.year,
-        })
+        return cached_json(f"user-{user.username}-{user.version}", lambda: json.dumps(user_dict(user)))
     else:
         return error("user not found")
 
+def user_dict(user):
+    """ the public fields of a user """
+    return {
+        'username': user.username,
+        'name': user.name,
+        'pronouns': user.pronouns,
+        'bio': user.bio,
+        'age': user.age,
+        'year': user.year,
+        'pfp_id': user.pfp_id,
+    }
+
 @app.route("/api/event/<id>")
 def get_event(id):
     """ get the user from the database """
     event = Events.get(id)
     if event is not None:
-        return json.dumps(event.__dict__)
+        return cached_json(f"event-{event.id}-{event.version}", lambda: json.dumps(event.to_dict()))
     else:
         return error("event not found")
 
 @app.route("/api/user/me/friends", methods =['GET'])
+def get_my_friends():
+    if 'username' not in session: return error("not logged in")
+    return get_friends(session['username'])
+
+@app.route("/api/user/<username>/friends", methods =['GET'])
 def get_friends(username):
-    # ADD AFTER ADDING FRIENDS TO USER.PY
-    l = []
-    data = request.json
-    if username not in data:
+    if UsersSlay.get(username) is None:
         return error("this user doesn't exist")
+    return json.dumps(Friends.get(username))
 
-    friend = UsersSlay.get_friends(username)
-    if friend is not None:
-        for i in friend:
-            l.append(i)
-        return l
-    else:
-        return error("this user doesn't have friends")
-
+@app.route("/api/user/me/friends/requests", methods =['GET'])
+def get_friend_requests():
+    if 'username' not in session: return error("not logged in")
+    return json.dumps(Friends.requests(session['username']))
 
-@app.route("/api/user/me/friends", methods =['PUT'])
-def add_friend(self, username):
-    data = request.json
-    if username not in data:
+@app.route("/api/user/me/friends/<username>", methods =['PUT'])
+def add_friend(username):
+    """ send a friend request, or accept one if they already sent us one """
+    if 'username' not in session: return error("not logged in")
+    if username == session['username']:
+        return error("you can't friend yourself")
+    if UsersSlay.get(username) is None:
         return error("This user doesn't exist")
-    UsersSlay.add_friend(self, username)
-
+    return json.dumps({"status": Friends.request(session['username'], username)})
 
-@app.route("/api/user/me/friends", methods=['DELETE'])
+@app.route("/api/user/me/friends/<username>", methods=['DELETE'])
 def delete_friend(username):
-    data = request.json
-    if username not in data:
-        return error("This user doesn't exist")
-    UsersSlay.delete_friend(username)
+    """ unfriend, or cancel or decline a request """
+    if 'username' not in session: return error("not logged in")
+    Friends.remove(session['username'], username)
+    return json.dumps({"success": True})
+
+@app.route("/api/user/me/friends/<username>/mutual", methods =['GET'])
+def get_mutual_friends(username):
+    if 'username' not in session: return error("not logged in")
+    return json.dumps(Friends.mutual(session['username'], username))
+
+@app.route("/api/user/me/friends/suggestions", methods =['GET'])
+def get_friend_suggestions():
+    """ friends of friends, most mutual friends first """
+    if 'username' not in session: return error("not logged in")
+    return json.dumps([
+        {"username": username, "mutual": mutual}
+        for username, mutual in Friends.suggestions(session['username'])
+    ])
 
 
 @app.route("/api/event/<id>/photos", methods=["GET"])
 def get_photo_ids(id):
     with get_db() as con:
         cur = con.cursor()
-        cur.execute("SELECT id FROM photos WHERE eventid = ?", id);
-        return json.dumps([row[0] for row in cur.fetchall()])
+        cur.execute("SELECT id FROM photos WHERE eventid = ?", [id])
+        body = json.dumps([row[0] for row in cur.fetchall()])
+    return cached_json(hashlib.sha256(body.encode()).hexdigest(), lambda: body)
 
 @app.route("/api/event/<id>/photos/<photoid>", methods=['GET'])
 def get_photo(id, photoid):
     event = Events.get(id)
     if event is not None:
-        photo = event.get_photo(photoid)
-        if photo is not None:
-            return Response(photo, mimetype="image/png")
+        hash = event.get_photo(photoid)
+        if hash is not None:
+            return send_blob(hash, immutable=True)
     return error("This photo doesn't exist")
 
 
 @app.route("/api/event/<id>/photos", methods =['POST'])
 def add_photo(id):
-    if not request.is_json:
-        return error("invalid req")
-    
-    data = base64.b64decode(request.json['data'])
     event = Events.get(id)
     if event is None:
         return error("This event doesn't exist")
-    return json.dumps({"id": event.add_photo(data) })
+    blob = upload()
+    if blob is None:
+        return error("invalid req")
+    photo = event.add_photo_blob(*blob)
+    notify(event.id, "photo_added", photo=photo)
+    return json.dumps({"id": photo})
 
-@app.route("/api/event/<id>/photos/<photoid>", methods =['DELETE'])
+@app.route("/api/event/<id>/photos/<int:photoid>", methods =['DELETE'])
 def delete_photo(id, photoid):
     event = Events.get(id)
     if event is None:
         return error("This event doesn't exist")
     Events.delete_photo(photoid)
+    notify(event.id, "photo_deleted", photo=photoid)
     return json.dumps({"success": True})
 
     
@@ -140,7 +318,7 @@ def create_user():
     if 'password' not in data:
         return error("password is required")
     password = data['password']
-    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    hashed = passwords.hash(password)
     if 'name' not in data:
         return error("name is required")
     name = data['name']
@@ -223,11 +401,10 @@ def update_user():
 @app.route("/api/event/<id>", methods=["DELETE"])
 def delete_event(id):
     event = Events.get(id)
-    if id is None: return error("evt not found")
+    if event is None: return error("evt not found")
     if 'username' not in session or session['username'] != event.owner:
         return error("you are not the owner (maury voice)")
-    with get_db() as con:
-        con.execute("DELETE FROM events WHERE id = ?", [id])
+    event.delete()
     return json.dumps({"success": True})
 
 @app.route("/api/event", methods=["PUT"])
@@ -271,6 +448,34 @@ def update_event():
     return get_me()
 
 
+def notify(event_id, type, username=None, **fields):
+    """ publish a change to the event's stream, and to the stream of the user it's about """
+    message = {"type": type, "event": event_id, **fields}
+    if username is not None:
+        message['username'] = username
+        pubsub.publish(pubsub.user_topic(username), message)
+    pubsub.publish(pubsub.event_topic(event_id), message)
+
+def event_stream(*topics):
+    res = Response(pubsub.Stream(pubsub.subscribe(*topics)), mimetype="text/event-stream", direct_passthrough=True)
+    res.headers['Cache-Control'] = "no-cache"
+    res.headers['X-Accel-Buffering'] = "no"
+    return res
+
+@app.route("/api/event/<id>/stream", methods=['GET'])
+def get_event_stream(id):
+    """ server-sent events for invites, attendees and photos of this event """
+    event = Events.get(id)
+    if event is None:
+        return error("This event doesn't exist")
+    return event_stream(pubsub.event_topic(event.id))
+
+@app.route("/api/user/me/stream", methods=['GET'])
+def get_my_stream():
+    """ server-sent events for invitations to (and changes to) the logged in user """
+    if 'username' not in session: return error("not logged in")
+    return event_stream(pubsub.user_topic(session['username']))
+
 @app.route("/api/event/<id>/users/<username>", methods=['POST'])
 def invite(id, username):
     event = Events.get(id)
@@ -278,10 +483,37 @@ def invite(id, username):
         return error("This event doesn't exist")
     if event.owner == username:
         return error("This user is the owner of the event")
+    if UsersSlay.get(username) is None:
+        return error("This user doesn't exist")
     # invite user to the event
     event.add_user(username)
+    notify(event.id, "invited", username)
     return json.dumps({"success": True})
 
+MAX_BULK_INVITES = 1000
+
+@app.route("/api/event/<id>/users", methods=['POST'])
+def invite_many(id):
+    """ invite a list of users at once: {"usernames": [...]} -> {username: result} """
+    if 'username' not in session: return error("not logged in")
+    event = Events.get(id)
+    if event is None:
+        return error("This event doesn't exist")
+    if session['username'] != event.owner:
+        return error("only the owner can invite people in bulk")
+    if not request.is_json or not isinstance(request.json.get('usernames'), list):
+        return error("usernames is required")
+    usernames = request.json['usernames']
+    if len(usernames) > MAX_BULK_INVITES:
+        return error(f"at most {MAX_BULK_INVITES} users at once")
+    if not all(isinstance(username, str) for username in usernames):
+        return error("usernames have to be strings")
+    results = event.add_users(usernames)
+    for username, result in results.items():
+        if result == 'invited':
+            notify(event.id, "invited", username)
+    return json.dumps(results)
+
 @app.route("/api/event/<id>/users", methods=['PUT'])
 def accept_invite(id):
     event = Events.get(id)
@@ -295,6 +527,7 @@ def accept_invite(id):
 
     with get_db() as con:
         con.execute("UPDATE eventCollab SET accepted = TRUE WHERE events = ? AND name = ?", [id, username])
+    notify(event.id, "accepted", username)
 
     return json.dumps({"success": True})
 
@@ -309,6 +542,7 @@ def leave_event(id):
 
     with get_db() as con:
         con.execute("DELETE FROM eventCollab where events = ? AND name = ?", [id, username])
+    notify(event.id, "left", username)
     return json.dumps({"success": True})
 
 @app.route("/api/event/<id>/users/<username>", methods=['DELETE'])
@@ -319,6 +553,7 @@ def decline_invite(id, username):
 
     with get_db() as con:
         con.execute("DELETE FROM eventCollab where events = ? AND name = ?", [id, username])
+    notify(event.id, "left", username)
     return json.dumps({"success": True})
 
 
@@ -353,6 +588,67 @@ def get_invitations():
         cur.execute("SELECT events FROM eventCollab WHERE name = ? AND ACCEPTED = FALSE", [username])
         return json.dumps([res[0] for res in cur.fetchall()])
 
+@app.route("/api/user/me/invitations/events", methods=['GET'])
+def get_invitation_events():
+    if 'username' not in session: return error("log in silly")
+    invitations = Events.get_by_collabed_user(session['username'], accepted=False)
+    return json.dumps([event.to_dict() for event in invitations])
+
+@app.route("/api/events", methods=['GET'])
+def get_events():
+    """ batch version of get_event: /api/events?ids=1,2,3 """
+    try:
+        ids = [int(id) for id in request.args.get('ids', '').split(',') if id]
+    except ValueError:
+        return error("ids must be numbers")
+    return json.dumps([event.to_dict() for event in Events.get_many(ids)])
+
+
+SEARCH_MAX_RESULTS = 50
+
+@app.route("/api/search", methods=['GET'])
+def get_search():
+    """ /api/search?q=<prefix>[&type=users|events][&limit=] ranked prefix search for typeahead """
+    q = request.args.get('q', '')
+    kind = request.args.get('type')
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), SEARCH_MAX_RESULTS))
+    except ValueError:
+        return error("limit has to be a number")
+    if kind not in (None, 'users', 'events'):
+        return error("type has to be users or events")
+    return json.dumps({
+        'users': search.users(q, limit) if kind != 'events' else [],
+        'events': [event.to_dict() for event in search.events(q, limit)] if kind != 'users' else [],
+    })
+
+
+NEARBY_MAX_RADIUS = 500
+NEARBY_MAX_RESULTS = 200
+
+@app.route("/api/events/nearby", methods=['GET'])
+def get_nearby_events():
+    """ /api/events/nearby?lat=&lon=&radius= (km), nearest first """
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius = float(request.args.get('radius', 10))
+        limit = int(request.args.get('limit', 50))
+    except (KeyError, ValueError):
+        return error("lat and lon are required")
+    if not (-90 <= lat <= 90):
+        return error("Not a valid latitude")
+    if not (-180 <= lon <= 180):
+        return error("Not a valid longitude")
+    if not (0 < radius <= NEARBY_MAX_RADIUS):
+        return error(f"radius has to be between 0 and {NEARBY_MAX_RADIUS} km")
+    limit = max(1, min(limit, NEARBY_MAX_RESULTS))
+
+    return json.dumps([
+        {**event.to_dict(), 'distance': distance}
+        for event, distance in Events.get_nearby(lat, lon, radius, limit)
+    ])
+
 
 @app.route("/api/user/<username>/pfp", methods=['GET'])
 def get_pfp(username):
@@ -360,7 +656,18 @@ def get_pfp(username):
     if user is None:
         return error("This user doesn't exist")
     
-    return Response(UsersSlay.get_pfp(user.pfp_id), mimetype="image/png")
+    hash = UsersSlay.get_pfp(user.pfp_id)
+    if hash is None:
+        return error("This user doesn't have a pfp")
+    return send_blob(hash)
+
+@app.route("/api/pfp/<int:pfp_id>", methods=['GET'])
+def get_pfp_by_id(pfp_id):
+    """ unlike /api/user/<username>/pfp this never changes, so it can be cached for good """
+    hash = UsersSlay.get_pfp(pfp_id)
+    if hash is None:
+        return error("This pfp doesn't exist")
+    return send_blob(hash, immutable=True)
 
 
 @app.route("/api/user/me/pfp", methods=['POST'])
@@ -371,10 +678,9 @@ def create_pfp():
     if user is None:
         return error("This user doesn't exist")
     
-    if not request.is_json: return error('bad req')
-    data = base64.b64decode(request.json['data'])
-    user.pfp_id = user.create_pfp(data)
-    user.update()
+    blob = upload()
+    if blob is None: return error('bad req')
+    user.set_pfp(*blob)
     return json.dumps({"success": True})
 
 
@@ -385,10 +691,9 @@ def update_pfp():
     user = UsersSlay.get(username)
     if user is None:
         return error("This user doesn't exist")
-    if not request.is_json: return error('bad req')
-    data = base64.b64decode(request.json['data'])
-    user.pfp_id = user.create_pfp(data)
-    user.update()
+    blob = upload()
+    if blob is None: return error('bad req')
+    user.set_pfp(*blob)
     return json.dumps({"success": True})
 
 
@@ -416,13 +721,26 @@ def login():
     if user is None:
         return error('user not found')
 
-    if not bcrypt.checkpw(password.encode(), user.password):
+    if not passwords.check(password, user.password):
         return error('invalid pw')
 
+    if passwords.needs_rehash(user.password):
+        user.password = passwords.hash(password)
+        user.update()
+
     session['username'] = username
     return get_me()
     
 
+@app.route('/metrics')
+def get_metrics():
+    """ request, sql and cache numbers for prometheus to scrape """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    return json.dumps(cache.stats())
+
 @app.route('/api/logout')
 def logout():
     if 'username' in session:
@@ -436,14 +754,121 @@ def get_my_events():
 
 @app.route('/api/user/<username>/events')
 def get_users_Events(username):
-    userevents = Events.get_by_user(username)
-    colabevents = Events.get_by_collabed_user(username)
-    e = []
-    for i in userevents:
-        e.append(i)
-    for n in colabevents:
-        e.append(n)
-    return json.dumps([z.__dict__ for z in e])
+    """ all of username's events, or with ?from=&to= only the ones overlapping that range """
+    if 'from' in request.args or 'to' in request.args:
+        window = time_range()
+        if window is None:
+            return error("from and to have to be numbers, with from < to")
+        return events.dumps(Events.get_in_range(username, *window, raw=True))
+    return events.dumps(Events.get_for_user(username, raw=True))
+
+@app.route('/api/user/<username>/calendar.ics')
+def get_calendar_feed(username):
+    """ username's events (owned or accepted) as an iCalendar feed to subscribe to. it's
+    streamed straight off the cursor. X-Sync-Token is a token to pass back as ?since= to get
+    only what's changed after this response, including events that have left the calendar.
+    a token older than maintenance.py keeps removals for gets a 410, and a full fetch again """
+    since = None
+    if 'since' in request.args:
+        try:
+            since = int(request.args['since'])
+        except ValueError:
+            return error("since has to be a sync token"), 400
+    clock, latest, pruned = Events.feed_state(username)
+    if since is not None and since < pruned:
+        return error("that sync token has expired, fetch the whole calendar again"), 410
+
+    # latest can go back down when maintenance.py forgets old removals, but that always
+    # moves pruned up first, so the pair never repeats with a different body
+    etag = f"calendar-{username}-{latest}-{pruned}"
+    res = not_modified(etag, "no-cache")
+    if res is None:
+        # the feed is read after this, so it can have changes newer than the token. those
+        # get sent again on the next sync, which is harmless, while the other way round
+        # they'd be missed
+        rows = Events.iter_feed(username, since)
+        removed = Events.iter_removed(username, since) if since is not None else ()
+        res = Response(stream_with_context(ics.calendar(username, request.host, rows, removed)),
+                       mimetype="text/calendar")
+        res.set_etag(etag)
+        res.headers['Cache-Control'] = "no-cache"
+    res.headers['X-Sync-Token'] = str(clock)
+    return res
+
+def time_range():
+    """ (from, to) from the query string, or None if they're missing or bad """
+    try:
+        start, end = int(request.args['from']), int(request.args['to'])
+    except (KeyError, ValueError):
+        return None
+    return (start, end) if start < end else None
+
+@app.route('/api/user/me/calendar')
+def get_calendar():
+    """ /api/user/me/calendar?from=&to= the events (owned or accepted) overlapping [from, to),
+    sorted by start, plus every pair of them that overlap each other """
+    if 'username' not in session: return error('not logged in')
+    window = time_range()
+    if window is None:
+        return error("from and to have to be numbers, with from < to")
+    events = Events.get_in_range(session['username'], *window)
+    return json.dumps({
+        'events': [event.to_dict() for event in events],
+        'conflicts': Events.find_conflicts(events),
+    })
+
+DASHBOARD_PAGE_SIZE = 100
+
+@app.route('/api/user/me/dashboard')
+def get_dashboard():
+    """ everything the dashboard needs in one request: the user, a page of their
+    events sorted by start, who is attending/invited to those, and (on the first page) pending invitations.
+    pass the returned `next` back as ?after= to get the following page.
+    with ?from=&to= the events are instead all of the ones overlapping [from, to), as in
+    /api/user/me/calendar, with the pairs of them that overlap each other as `conflicts` """
+    if 'username' not in session: return error('not logged in')
+    username = session['username']
+
+    user = UsersSlay.get(username)
+    if user is None:
+        return error("user not found")
+
+    if 'from' in request.args or 'to' in request.args:
+        window = time_range()
+        if window is None:
+            return error("from and to have to be numbers, with from < to")
+        events = Events.get_in_range(username, *window)
+        return json.dumps({
+            'user': user_dict(user),
+            'events': [event.to_dict() for event in events],
+            'conflicts': Events.find_conflicts(events),
+            'collaborators': Events.get_collaborators([event.id for event in events]),
+            'invitations': [event.to_dict() for event in Events.get_by_collabed_user(username, accepted=False)],
+            'next': None,
+        })
+
+    try:
+        limit = min(int(request.args.get('limit', DASHBOARD_PAGE_SIZE)), DASHBOARD_PAGE_SIZE)
+        after = None
+        if 'after' in request.args:
+            start, id = request.args['after'].split(',')
+            after = (int(start), int(id))
+    except ValueError:
+        return error("invalid page")
+    if limit <= 0:
+        return error("invalid page")
+
+    events = Events.get_for_user(username, after, limit)
+    collaborators = Events.get_collaborators([event.id for event in events])
+    invitations = Events.get_by_collabed_user(username, accepted=False) if after is None else []
+
+    return json.dumps({
+        'user': user_dict(user),
+        'events': [event.to_dict() for event in events],
+        'collaborators': collaborators,
+        'invitations': [event.to_dict() for event in invitations],
+        'next': f"{events[-1].start},{events[-1].id}" if len(events) == limit else None,
+    })
 
 def collab_user(username, id):
     shared_event = Events.get(id)
@@ -489,16 +914,36 @@ def create_event():
     event = Events(-1, data['name'], owner, data['start'], data['end'], data['location_lat'], data['location_lon'])
     event.create()
     
-    return json.dumps(event.__dict__)
+    return json.dumps(event.to_dict())
+
+def send_asset(asset, cache_control):
+    """ a file from public/, compressed in whichever way the client takes that's smallest.
+    each encoding gets its own etag, so a cache never mixes them up """
+    encoding = asset.pick(request.accept_encodings)
+    etag = asset.etag if encoding == "identity" else f"{asset.etag}-{encoding}"
+    res = not_modified(etag, cache_control)
+    if res is None:
+        res = Response(asset.encodings[encoding], mimetype=asset.mimetype)
+        res.set_etag(etag)
+        res.headers['Cache-Control'] = cache_control
+        if encoding != "identity":
+            res.headers['Content-Encoding'] = encoding
+    res.vary.add('Accept-Encoding')
+    return res
 
 @app.route("/public/<path:path>", methods=['GET'])
 def serve_public(path):
-    return send_from_directory('../public', path)
+    """ /public/app.1a2b3c4d5e6f.js (what index.html links to) never changes, so it's
+    cached for good. the plain name is still there for old pages, revalidated every time """
+    asset, immutable = assets.get(path)
+    if asset is None:
+        return error("not found"), 404
+    return send_asset(asset, IMMUTABLE if immutable else "no-cache")
 
 @app.route('/', defaults={'path': ''})
 
 
 @app.route('/<path:path>')
 def serve_page(path):
-    return app.send_static_file("index.html")
+    return send_asset(assets.index(), "no-cache")
 
@@ -0,0 +1,376 @@
+"""
+serve the same app over ASGI, eg
+
+    uvicorn asgi:application
+
+the event loop owns every socket: request bodies are read and responses (photos, event
+streams) are written on it, so a slow client costs a coroutine instead of a thread. the
+views themselves are plain flask and talk to sqlite, so they run in a bounded pool of
+VIEW_WORKERS threads. bodies a view streams from a generator (the calendar feed) are
+iterated in a pool of their own, since that thread waits on the client
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import admission
+import blobs
+import db
+import images
+import passwords
+from app import app
+
+# threads running views. more than the connection pool just means waiting on sqlite's write lock
+VIEW_WORKERS = int(os.environ.get("VIEW_WORKERS", str(db.POOL_SIZE)))
+# request bodies bigger than this are spooled to a temp file instead of kept in memory
+SPOOL_SIZE = 1024 * 1024
+# chunks of a streamed (non-file) body allowed to be waiting on a slow client
+STREAM_BUFFER = 8
+# threads iterating streamed bodies. each is held for as long as its client takes to read
+# (the generator has to stay on one thread, for flask's context and the leased connection)
+STREAM_WORKERS = int(os.environ.get("STREAM_WORKERS", "32"))
+# seconds a streamed body waits on a client that isn't reading before it's cut off
+STREAM_STALL = float(os.environ.get("STREAM_STALL", "60"))
+# a request body has BODY_GRACE seconds, then has to keep arriving at BODY_MIN_RATE bytes a
+# second on average, or the request gets a 408. otherwise a client trickling its body in
+# holds an upload's place for as long as it likes
+BODY_GRACE = float(os.environ.get("BODY_GRACE", "10"))
+BODY_MIN_RATE = float(os.environ.get("BODY_MIN_RATE", str(8 * 1024)))
+
+_views = ThreadPoolExecutor(VIEW_WORKERS, thread_name_prefix="view")
+# file reads are quick, but shouldn't queue up behind slow views
+_files = ThreadPoolExecutor(4, thread_name_prefix="file")
+# so stalled readers of a streamed body can't take the view threads
+_streams = ThreadPoolExecutor(STREAM_WORKERS, thread_name_prefix="stream")
+
+
+class FileBody(object):
+	""" wsgi.file_wrapper: send_file() wraps the file in this, and the loop sends it in chunks
+	without holding a view thread for as long as the client takes to read it """
+
+	def __init__(self, file, block_size: int = blobs.CHUNK_SIZE):
+		self.file = file
+		# send_file asks for 8 KB, but every read is a hop to a thread. much bigger and
+		# each slow client pins more memory in its transport's buffer
+		self.block_size = max(block_size, blobs.CHUNK_SIZE)
+
+	def __iter__(self):
+		while True:
+			chunk = self.file.read(self.block_size)
+			if not chunk:
+				return
+			yield chunk
+
+	async def __aiter__(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			chunk = await loop.run_in_executor(_files, self.file.read, self.block_size)
+			if not chunk:
+				return
+			yield chunk
+
+	def close(self):
+		self.file.close()
+
+
+async def application(scope, receive, send):
+	if scope["type"] == "lifespan":
+		await _lifespan(receive, send)
+		return
+	if scope["type"] != "http":
+		return
+
+	# an upload has to be let in before its body is read, or the cap on them would come
+	# after all the work it's meant to save. its address is charged first, so one client
+	# can't keep taking the places (app.py charges the user once it knows who it is)
+	upload = _upload_size(scope) if admission.ENABLED else None
+	if upload is not None:
+		try:
+			admission.check(_client_address(scope), cost=admission.UPLOAD_COST)
+			admission.start_upload(upload)
+		except admission.RateLimited as e:
+			await _reject(receive, send, "429 Too Many Requests", b'{"error": "too many requests, slow down"}', e)
+			return
+		except admission.Overloaded as e:
+			await _reject(receive, send, "503 Service Unavailable",
+				b'{"error": "too many uploads right now, try again in a moment"}', e)
+			return
+
+	try:
+		try:
+			body, size = await _read_body(scope, receive)
+		except _Disconnected:
+			return
+		except _TooSlow:
+			timeout = b'{"error": "the request body came in too slowly"}'
+			await _send_response(send, "408 Request Timeout", [("Content-Type", "application/json"),
+				("Content-Length", str(len(timeout))), ("Connection", "close")], timeout)
+			return
+
+		loop = asyncio.get_running_loop()
+		chunks = asyncio.Queue(STREAM_BUFFER)
+		state = {"closed": False}
+		environ = _environ(scope, body, size)
+		if upload is not None:
+			environ[admission.ENVIRON_KEY] = upload
+		try:
+			status, headers, content = await loop.run_in_executor(
+				_views, _call_view, environ, loop, chunks, state)
+		finally:
+			body.close()
+	finally:
+		if upload is not None:
+			admission.finish_upload(upload)
+
+	if isinstance(content, bytes):
+		await _send_response(send, status, headers, content)
+		return
+
+	# a streamed body: either async (files, event streams) or chunks coming from a stream thread
+	sending = state["sending"] = asyncio.ensure_future(_send_stream(send, status, headers, content, chunks))
+	disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+	done = ()
+	try:
+		done, _ = await asyncio.wait([sending, disconnect], return_when=asyncio.FIRST_COMPLETED)
+	finally:
+		sending.cancel()
+		disconnect.cancel()
+		state["closed"] = True
+		# let a stream thread blocked on a full queue notice
+		while not chunks.empty():
+			chunks.get_nowait()
+		if hasattr(content, "close"):
+			content.close()
+	if sending in done and not sending.cancelled() and sending.exception() is not None:
+		raise sending.exception()
+
+
+def _call_view(environ, loop, chunks, state):
+	""" runs in the view pool. returns (status, headers, content) where content is the whole
+	body as bytes, an async iterable for the loop to send, or None if it'll come through chunks """
+	started = []
+
+	def start_response(status, headers, exc_info=None):
+		started[:] = [status, headers]
+
+	res = app(environ, start_response)
+	status, headers = started
+	if hasattr(res, "__aiter__"):
+		return status, headers, res
+	if (environ["REQUEST_METHOD"] == "HEAD" or status[:3] in ("204", "304")
+			or any(name.lower() == "content-length" for name, _ in headers)):
+		# the common case: a response small enough that flask knows its length
+		try:
+			return status, headers, b"".join(res)
+		finally:
+			if hasattr(res, "close"):
+				res.close()
+	_streams.submit(_pump, res, loop, chunks, state)
+	return status, headers, None
+
+
+def _pump(res, loop, chunks, state):
+	""" iterate a generator body on a stream thread, handing chunks to the loop. the queue
+	is bounded, so a slow client holds this thread the way it would under wsgi, for up to
+	STREAM_STALL seconds without taking anything """
+
+	def put(chunk):
+		future = asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop)
+		deadline = time.monotonic() + STREAM_STALL
+		while True:
+			try:
+				return future.result(1)
+			except TimeoutError:
+				if time.monotonic() > deadline and not state["closed"]:
+					# the loop is stuck sending to the client. cancelling that ends the response
+					state["closed"] = True
+					loop.call_soon_threadsafe(state["sending"].cancel)
+				if state["closed"]:
+					future.cancel()
+					return
+
+	try:
+		for chunk in res:
+			if state["closed"]:
+				return
+			if chunk:
+				put(chunk)
+		put(None)
+	finally:
+		if hasattr(res, "close"):
+			res.close()
+		# a generator using stream_with_context can lease a connection on this thread
+		db.release_db()
+
+
+async def _send_stream(send, status, headers, content, chunks):
+	await send({"type": "http.response.start", "status": int(status[:3]), "headers": _headers(headers)})
+	if content is not None:
+		async for chunk in content:
+			await send({"type": "http.response.body", "body": chunk, "more_body": True})
+	else:
+		while True:
+			chunk = await chunks.get()
+			if chunk is None:
+				break
+			await send({"type": "http.response.body", "body": chunk, "more_body": True})
+	await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def _send_response(send, status, headers, body):
+	""" a response whose body is all there already """
+	await send({"type": "http.response.start", "status": int(status[:3]), "headers": _headers(headers)})
+	await send({"type": "http.response.body", "body": body})
+
+
+async def _wait_disconnect(receive):
+	while (await receive())["type"] != "http.disconnect":
+		pass
+
+
+class _Disconnected(Exception):
+	""" the client went away before sending the whole request """
+
+
+class _TooSlow(Exception):
+	""" the request body is arriving slower than BODY_MIN_RATE """
+
+
+async def _receive_body(receive, started: float, size: int) -> dict:
+	""" receive() the next part of a request body that started arriving at started
+	(time.monotonic()) and has size bytes so far, or raise _TooSlow """
+	timeout = started + BODY_GRACE + size / BODY_MIN_RATE - time.monotonic()
+	try:
+		return await asyncio.wait_for(receive(), max(timeout, 0))
+	except asyncio.TimeoutError:
+		raise _TooSlow()
+
+
+async def _reject(receive, send, status: str, body: bytes, e: admission.Rejected):
+	""" turn a request away before it's been read, with a Retry-After """
+	# hanging up on a body that's still coming resets the connection and the client never
+	# sees the response, so it's read first. that costs bandwidth, but nothing is kept (and
+	# uvicorn reports a disconnect for anything read after the response). a client too slow
+	# to wait for gets the response anyway, and the connection is closed
+	started = time.monotonic()
+	size = 0
+	try:
+		while True:
+			message = await _receive_body(receive, started, size)
+			if message["type"] == "http.disconnect":
+				return
+			size += len(message.get("body", b""))
+			if not message.get("more_body", False):
+				break
+	except _TooSlow:
+		pass
+	await _send_response(send, status, [("Content-Type", "application/json"), ("Content-Length", str(len(body))),
+		("Retry-After", e.retry_after_header())], body)
+
+
+def _client_address(scope) -> str:
+	""" admission.client_address() from the request's peer and headers """
+	client = scope.get("client") or ("", 0)
+	forwarded = [value.decode("latin-1") for name, value in scope["headers"] if name == b"x-forwarded-for"]
+	return admission.client_address(client[0], ",".join(forwarded))
+
+
+def _upload_size(scope):
+	""" admission.upload_size() from the request's headers """
+	mimetype = ""
+	length = None
+	for name, value in scope["headers"]:
+		if name == b"content-type":
+			mimetype = value.decode("latin-1").split(";", 1)[0].strip().lower()
+		elif name == b"content-length":
+			length = int(value)
+	return admission.upload_size(scope["method"], mimetype, length, app.config["MAX_CONTENT_LENGTH"])
+
+
+async def _read_body(scope, receive):
+	""" (the request body as a file, its size). reading stops once it's over
+	MAX_CONTENT_LENGTH and flask answers with its usual 413. raises _TooSlow if it's
+	coming in slower than BODY_MIN_RATE """
+	limit = app.config["MAX_CONTENT_LENGTH"]
+	body = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+	for name, value in scope["headers"]:
+		if name == b"content-length" and limit is not None and int(value) > limit:
+			return body, int(value)
+	started = time.monotonic()
+	size = 0
+	more = True
+	while more and (limit is None or size <= limit):
+		try:
+			message = await _receive_body(receive, started, size)
+		except _TooSlow:
+			body.close()
+			raise
+		if message["type"] == "http.disconnect":
+			body.close()
+			raise _Disconnected()
+		chunk = message.get("body", b"")
+		body.write(chunk)
+		size += len(chunk)
+		more = message.get("more_body", False)
+	body.seek(0)
+	return body, size
+
+
+async def _lifespan(receive, send):
+	while True:
+		message = await receive()
+		if message["type"] == "lifespan.startup":
+			await send({"type": "lifespan.startup.complete"})
+		elif message["type"] == "lifespan.shutdown":
+			_views.shutdown(wait=True)
+			_files.shutdown(wait=True)
+			_streams.shutdown(wait=True)
+			images.shutdown()
+			passwords.shutdown()
+			db.close_all()
+			await send({"type": "lifespan.shutdown.complete"})
+			return
+
+
+def _environ(scope, body, size) -> dict:
+	server = scope.get("server") or ("localhost", 80)
+	client = scope.get("client") or ("", 0)
+	environ = {
+		"REQUEST_METHOD": scope["method"],
+		"SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+		"PATH_INFO": scope["path"].encode().decode("latin-1"),
+		"QUERY_STRING": scope["query_string"].decode("latin-1"),
+		"SERVER_NAME": server[0],
+		"SERVER_PORT": str(server[1]),
+		"SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+		"REMOTE_ADDR": client[0],
+		"REMOTE_PORT": str(client[1]),
+		"wsgi.version": (1, 0),
+		"wsgi.url_scheme": scope.get("scheme", "http"),
+		"wsgi.input": body,
+		"wsgi.errors": sys.stderr,
+		"wsgi.multithread": True,
+		"wsgi.multiprocess": False,
+		"wsgi.run_once": False,
+		"wsgi.file_wrapper": FileBody,
+		# all of the body is in wsgi.input, even when it was sent chunked
+		"wsgi.input_terminated": True,
+	}
+	for name, value in scope["headers"]:
+		name = name.decode("latin-1").upper().replace("-", "_")
+		value = value.decode("latin-1")
+		if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+			name = "HTTP_" + name
+		if name in environ:
+			value = environ[name] + "," + value
+		environ[name] = value
+	# the body has been read already, so its length is known even if it was sent chunked
+	environ.setdefault("CONTENT_LENGTH", str(size))
+	return environ
+
+
+def _headers(headers) -> list:
+	return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
@@ -0,0 +1,109 @@
+"""
+the files in public/, loaded into memory once and compressed ahead of time with gzip and
+brotli. each file is also served under a name with a hash of its contents in it
+(app.js -> app.1a2b3c4d5e6f.js) that can be cached forever, and index.html is rewritten
+to point at those names, so a deploy only ever invalidates the page itself
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+import brotli
+
+PUBLIC_DIR = os.path.abspath(os.environ.get("PUBLIC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public")))
+# set ASSET_RELOAD=1 while working on the client: files are reloaded when they change on disk
+RELOAD = os.environ.get("ASSET_RELOAD", "0") != "0"
+# a compressed copy is only kept if it's at most this fraction of the original
+MIN_SAVING = 0.9
+INDEX = "index.html"
+
+_assets = {}
+_hashed = {}
+_mtimes = {}
+
+
+class Asset(object):
+	""" one file and its precompressed copies. encodings maps content-encoding -> body,
+	with "identity" for the file as it is """
+	__slots__ = ("name", "hashed_name", "mimetype", "etag", "encodings")
+
+	def __init__(self, name: str, data: bytes):
+		digest = hashlib.sha256(data).hexdigest()
+		stem, ext = os.path.splitext(name)
+		self.name = name
+		self.hashed_name = f"{stem}.{digest[:12]}{ext}"
+		self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+		self.etag = digest[:32]
+		self.encodings = {"identity": data}
+		compressed = [("gzip", gzip.compress(data, 9, mtime=0)), ("br", brotli.compress(data))]
+		for encoding, body in compressed:
+			if len(body) <= len(data) * MIN_SAVING:
+				self.encodings[encoding] = body
+
+	def pick(self, accept) -> str:
+		""" the smallest encoding we have that the client accepts (a werkzeug Accept) """
+		best = "identity"
+		for encoding, body in self.encodings.items():
+			if encoding != "identity" and accept[encoding] > 0 and len(body) < len(self.encodings[best]):
+				best = encoding
+		return best
+
+
+def _files():
+	for root, dirs, files in os.walk(PUBLIC_DIR):
+		dirs[:] = [name for name in dirs if not name.startswith(".")]
+		for file in files:
+			if not file.startswith("."):
+				path = os.path.join(root, file)
+				yield os.path.relpath(path, PUBLIC_DIR).replace(os.sep, "/"), path
+
+
+def load():
+	""" (re)read everything in PUBLIC_DIR """
+	global _assets, _hashed, _mtimes
+	assets = {}
+	mtimes = {}
+	for name, path in _files():
+		with open(path, "rb") as f:
+			data = f.read()
+		mtimes[name] = os.stat(path).st_mtime
+		if name != INDEX:
+			assets[name] = Asset(name, data)
+	if INDEX in mtimes:
+		with open(os.path.join(PUBLIC_DIR, INDEX), "rb") as f:
+			page = f.read()
+		for asset in assets.values():
+			page = page.replace(f'"/public/{asset.name}"'.encode(), f'"{url(asset)}"'.encode())
+		assets[INDEX] = Asset(INDEX, page)
+	_assets = assets
+	_hashed = {asset.hashed_name: asset for asset in assets.values()}
+	_mtimes = mtimes
+
+
+def _changed() -> bool:
+	return {name: os.stat(path).st_mtime for name, path in _files()} != _mtimes
+
+
+def get(name: str) -> (Asset, bool):
+	""" (asset, immutable) for a path under /public/, by its plain or hashed name. the
+	hashed name is what's immutable. (None, False) if there's no such file """
+	if RELOAD and _changed():
+		load()
+	asset = _hashed.get(name)
+	if asset is not None:
+		return asset, True
+	return _assets.get(name), False
+
+
+def index() -> Asset:
+	if RELOAD and _changed():
+		load()
+	return _assets.get(INDEX)
+
+
+def url(asset: Asset) -> str:
+	return f"/public/{asset.hashed_name}"
+
+
+load()
@@ -0,0 +1,59 @@
+"""
+micro-benchmarks for the server. run them from the server/ directory, eg
+
+    python -m bench.connections
+"""
+import os
+import socket
+import tempfile
+import time
+
+# every benchmark's requests come from one address, which admission control would soon
+# start turning away. this has to happen before anything imports admission
+os.environ.setdefault("ADMISSION_ENABLED", "0")
+
+import blobs
+import db
+from migrate import migrate
+
+
+def fresh_db() -> str:
+	""" make an empty database (and blob store) in a temp dir with every migration applied,
+	and point db and blobs at it """
+	dir = tempfile.mkdtemp(prefix="planner-bench-")
+	path = os.path.join(dir, "bench.db")
+	blobs.BLOB_DIR = os.path.join(dir, "blobs")
+	db.set_db_path(path)
+	migrate()
+	return path
+
+
+def timeit(fn, n: int) -> float:
+	""" average seconds per call of fn over n calls """
+	start = time.perf_counter()
+	for _ in range(n):
+		fn()
+	return (time.perf_counter() - start) / n
+
+
+def report(name: str, seconds: float):
+	print(f"{name:<40} {seconds * 1e6:10.1f} us")
+
+
+def percentile(samples, p: float) -> float:
+	""" the p-th percentile of samples (nearest rank) """
+	ordered = sorted(samples)
+	if not ordered:
+		return float("nan")
+	return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def listen() -> socket.socket:
+	""" a listening socket on a free local port, for benchmarks that start a real server.
+	IPPROTO_TCP has to be explicit: asyncio only sets TCP_NODELAY on sockets that say so,
+	and without it every keep-alive response waits out a 40ms delayed ack """
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(2048)
+	return sock
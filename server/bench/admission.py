@@ -0,0 +1,194 @@
+"""
+cheap reads during an upload flood, with admission control off and on. UPLOADERS clients
+(each from its own address, through X-Forwarded-For) keep posting a 4 MB photo to one
+event while a probe fetches the event every PROBE_EVERY seconds. TRICKLERS more send an
+upload's body TRICKLE bytes a second, too slowly to ever finish, to check they're cut off
+(asgi.BODY_MIN_RATE) instead of holding upload places for good. reports the probe's
+latency, how many uploads got through or were turned away, how the slow ones ended and
+how long they lasted, and the server's peak memory
+
+    python -m bench.admission [--uploaders N] [--tricklers N] [--duration S]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import subprocess
+import sys
+import time
+
+from bench import listen, percentile
+
+UPLOADERS = 32
+# fewer than admission.MAX_UPLOADS, so there's a place left while they hold theirs
+TRICKLERS = 2
+TRICKLE = 512
+# long enough for the tricklers to run past asgi.BODY_GRACE
+DURATION = 20
+PROBE_EVERY = 0.02
+PHOTO_SIZE = 4 * 1024 * 1024
+# an uploader that's turned away tries again after this long (or the Retry-After, if shorter)
+BACKOFF = 0.1
+
+
+def serve():
+	""" child: one event and nothing else, prints its port """
+	from bench import fresh_db
+	fresh_db()
+	from events import Events
+	from user import UsersSlay
+
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	Events(-1, "bench event", "bench", 1, 2, 0.0, 0.0).create()
+
+	import uvicorn
+	from asgi import application
+	sock = listen()
+	print(sock.getsockname()[1], flush=True)
+	uvicorn.Server(uvicorn.Config(application, log_level="warning", backlog=2048)).run(sockets=[sock])
+
+
+async def request(port: int, head: bytes, body: bytes = b"") -> int:
+	""" send one request on a new connection, return the status """
+	reader, writer = await asyncio.open_connection("127.0.0.1", port)
+	try:
+		writer.write(head)
+		try:
+			# the server may answer (and hang up) before it's read the body
+			writer.write(body)
+			await writer.drain()
+		except ConnectionError:
+			pass
+		line = await reader.readline()
+		await reader.read()
+		return int(line.split()[1]) if line else 0
+	finally:
+		writer.close()
+
+
+async def uploader(port: int, number: int, photo: bytes, stop: asyncio.Event, counts: dict):
+	head = (f"POST /api/event/1/photos HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+		f"X-Forwarded-For: 10.0.{number // 256}.{number % 256}\r\nContent-Type: image/png\r\n"
+		f"Content-Length: {len(photo)}\r\n\r\n").encode()
+	while not stop.is_set():
+		try:
+			status = await request(port, head, photo)
+		except (OSError, ValueError, IndexError):
+			status = 0
+		counts[status] = counts.get(status, 0) + 1
+		if status != 200:
+			await asyncio.sleep(BACKOFF)
+
+
+async def trickler(port: int, number: int, size: int, stop: asyncio.Event, ended: list):
+	""" appends (status, seconds it took) for each request the server ended """
+	head = (f"POST /api/event/1/photos HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+		f"X-Forwarded-For: 10.2.{number // 256}.{number % 256}\r\nContent-Type: image/png\r\n"
+		f"Content-Length: {size}\r\n\r\n").encode()
+	while not stop.is_set():
+		status = None
+		writer = None
+		start = time.perf_counter()
+		try:
+			reader, writer = await asyncio.open_connection("127.0.0.1", port)
+			writer.write(head)
+			while not stop.is_set():
+				writer.write(bytes(TRICKLE))
+				await writer.drain()
+				try:
+					line = await asyncio.wait_for(reader.readline(), 1)
+				except asyncio.TimeoutError:
+					continue
+				status = int(line.split()[1]) if line else 0
+				break
+		except (OSError, ValueError, IndexError):
+			status = 0
+		finally:
+			if writer is not None:
+				writer.close()
+		# one still going when the run ends isn't counted
+		if status is not None:
+			ended.append((status, time.perf_counter() - start))
+		await asyncio.sleep(BACKOFF)
+
+
+async def probe(port: int, latencies: list, stop: asyncio.Event):
+	head = b"GET /api/event/1 HTTP/1.1\r\nHost: localhost\r\nX-Forwarded-For: 10.1.0.1\r\nConnection: close\r\n\r\n"
+	while not stop.is_set():
+		start = time.perf_counter()
+		try:
+			await asyncio.wait_for(request(port, head), 30)
+			latencies.append(time.perf_counter() - start)
+		except (OSError, asyncio.TimeoutError):
+			latencies.append(float("inf"))
+		await asyncio.sleep(PROBE_EVERY)
+
+
+async def flood(port: int, pid: int, uploaders: int, tricklers: int, seconds: float, photo: bytes) -> dict:
+	stop = asyncio.Event()
+	latencies, counts, trickled = [], {}, []
+	tasks = [asyncio.ensure_future(probe(port, latencies, stop))]
+	tasks += [asyncio.ensure_future(uploader(port, n, photo, stop, counts)) for n in range(uploaders)]
+	tasks += [asyncio.ensure_future(trickler(port, n, len(photo), stop, trickled)) for n in range(tricklers)]
+	peak = 0
+	deadline = time.monotonic() + seconds
+	while time.monotonic() < deadline:
+		await asyncio.sleep(0.5)
+		peak = max(peak, rss_mb(pid))
+	stop.set()
+	await asyncio.gather(*tasks)
+	return {"probe_p50_ms": percentile(latencies, 50) * 1000, "probe_p99_ms": percentile(latencies, 99) * 1000,
+		"probes": len(latencies), "uploads": counts, "trickled": trickled, "peak_rss_mb": peak}
+
+
+def rss_mb(pid: int) -> float:
+	with open(f"/proc/{pid}/status") as f:
+		for line in f:
+			if line.startswith("VmRSS:"):
+				return int(line.split()[1]) / 1024
+	return 0
+
+
+def run(enabled: bool, args, photo: bytes):
+	env = dict(os.environ, ADMISSION_ENABLED="1" if enabled else "0", TRUSTED_PROXIES="1")
+	child = subprocess.Popen([sys.executable, "-m", "bench.admission", "serve"], env=env,
+		stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+	try:
+		port = int(child.stdout.readline())
+		time.sleep(1)
+		# the probe on its own first, for a baseline
+		quiet = asyncio.run(flood(port, child.pid, 0, 0, 2, photo))
+		result = asyncio.run(flood(port, child.pid, args.uploaders, args.tricklers, args.duration, photo))
+	finally:
+		child.terminate()
+		child.wait()
+	uploads = result["uploads"]
+	trickled = collections.Counter(status for status, _ in result["trickled"])
+	held = max((seconds for _, seconds in result["trickled"]), default=0)
+	print(f"admission {'on ' if enabled else 'off'}  idle probe p99 {quiet['probe_p99_ms']:7.1f} ms  "
+		f"flood probe p50 {result['probe_p50_ms']:7.1f} ms  p99 {result['probe_p99_ms']:7.1f} ms  "
+		f"uploads ok {uploads.get(200, 0)}  turned away {uploads.get(503, 0) + uploads.get(429, 0)}  "
+		f"failed {sum(count for status, count in uploads.items() if status not in (200, 429, 503))}  "
+		f"slow ended {dict(trickled)} after at most {held:.1f} s  "
+		f"peak {result['peak_rss_mb']:.0f} MB", flush=True)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="read latency during an upload flood, admission control off and on")
+	parser.add_argument("--uploaders", type=int, default=UPLOADERS)
+	parser.add_argument("--tricklers", type=int, default=TRICKLERS)
+	parser.add_argument("--duration", type=float, default=DURATION)
+	args = parser.parse_args()
+
+	from bench.seed import noise_png
+	photo = noise_png(random.Random(0), PHOTO_SIZE)
+	for enabled in (False, True):
+		run(enabled, args, photo)
+
+
+if __name__ == "__main__":
+	if sys.argv[1:2] == ["serve"]:
+		serve()
+	else:
+		main()
@@ -0,0 +1,43 @@
+"""
+requests per second for GET /api/event/<id> with the Events.get / UsersSlay.get cache on
+and off, and the same for bare Events.get calls (what the cache actually saves, without
+the rest of the request around it)
+"""
+import time
+
+import cache
+from bench import fresh_db
+
+N = 5000
+
+
+def main():
+	fresh_db()
+	import events
+	from app import app
+	from events import Events
+	from user import UsersSlay
+
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	evt = Events(-1, "bench event", "bench", 1, 2, 0.0, 0.0)
+	evt.create()
+	client = app.test_client()
+
+	for enabled in [False, True]:
+		events._cache.enabled = enabled
+		start = time.perf_counter()
+		for _ in range(N):
+			client.get(f"/api/event/{evt.id}")
+		elapsed = time.perf_counter() - start
+		print(f"cache {'on ' if enabled else 'off'}  {N / elapsed:8.0f} req/s")
+
+		start = time.perf_counter()
+		for _ in range(N * 10):
+			Events.get(evt.id)
+		elapsed = time.perf_counter() - start
+		print(f"cache {'on ' if enabled else 'off'}  {N * 10 / elapsed:8.0f} Events.get/s")
+	print(cache.stats())
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,39 @@
+"""
+per-request connection overhead: a fresh sqlite3.connect per call (the old get_db)
+vs the pooled, tuned connections from db.get_db
+"""
+import sqlite3
+
+import db
+import events
+import user
+from bench import fresh_db, timeit, report
+from events import Events
+from user import UsersSlay
+
+N = 2000
+
+
+def main():
+	path = fresh_db()
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	evt = Events(-1, "bench event", "bench", 1, 2, 0.0, 0.0)
+	evt.create()
+
+	def request():
+		# roughly what one route does: look up the user and the event. load() skips the
+		# cache, which would otherwise answer without touching a connection at all
+		UsersSlay.load("bench")
+		Events.load(evt.id)
+		db.release_db()
+
+	# the old get_db: a brand new connection, never closed, per call
+	events.get_db = user.get_db = lambda: sqlite3.connect(path)
+	report("connect per call", timeit(request, N))
+
+	events.get_db = user.get_db = db.get_db
+	report("pooled", timeit(request, N))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,43 @@
+"""
+friend listing, mutual friends and suggestions on a generated graph of N users with an
+average degree of D (100k users, degree 200 by default: 20M edge rows, so give it a while)
+
+    python -m bench.friends [N] [D]
+"""
+import random
+import sys
+
+import db
+from bench import fresh_db, timeit, report
+from Friends import Friends
+
+QUERIES = 50
+
+
+def main(n: int, degree: int):
+	fresh_db()
+	rng = random.Random(0)
+	with db.get_db() as con:
+		con.executemany("INSERT INTO users (username, password, name) VALUES (?, ?, ?)",
+			((f"user{i}", b"x", f"User {i}") for i in range(n)))
+
+		def edges():
+			# each user befriends degree / 2 others, which averages out to degree per user
+			for i in range(n):
+				for j in rng.sample(range(n), degree // 2):
+					if i != j:
+						yield f"user{i}", f"user{j}"
+						yield f"user{j}", f"user{i}"
+
+		con.executemany("INSERT OR IGNORE INTO friendEdges (username, friend, status) VALUES (?, ?, 'friends')", edges())
+
+	users = [f"user{rng.randrange(n)}" for _ in range(QUERIES * 2)]
+	it = iter(users * 100)
+
+	report(f"friends of one user (~{degree})", timeit(lambda: Friends.get(next(it)), QUERIES))
+	report("mutual friends of two users", timeit(lambda: Friends.mutual(next(it), next(it)), QUERIES))
+	report("friend-of-friend suggestions", timeit(lambda: Friends.suggestions(next(it)), QUERIES))
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000, int(sys.argv[2]) if len(sys.argv) > 2 else 200)
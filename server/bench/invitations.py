@@ -0,0 +1,37 @@
+"""
+loading a user's invitations: one Events.get per invited id (what the dashboard
+used to do through /api/event/<id>) vs the single JOIN in get_by_collabed_user
+"""
+import db
+from bench import fresh_db, timeit, report
+from events import Events
+from user import UsersSlay
+
+
+def main():
+	fresh_db()
+	UsersSlay("owner", b"x", "Owner", None, None, None, None, 0, None).create()
+	UsersSlay("guest", b"x", "Guest", None, None, None, None, 0, None).create()
+
+	invited = 0
+	for n in [10, 100, 1000]:
+		while invited < n:
+			evt = Events(-1, f"event {invited}", "owner", 1, 2, 0.0, 0.0)
+			evt.create()
+			evt.add_user("guest")
+			invited += 1
+
+		def fan_out():
+			with db.get_db() as con:
+				ids = [row[0] for row in con.execute("SELECT events FROM eventCollab WHERE name = ? AND accepted = FALSE", ["guest"])]
+			return [Events.get(id) for id in ids]
+
+		def joined():
+			return Events.get_by_collabed_user("guest", accepted=False)
+
+		report(f"{n} invitations, one get per id", timeit(fan_out, 20))
+		report(f"{n} invitations, one join", timeit(joined, 20))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,82 @@
+"""
+read latency under a login storm: LOGIN_THREADS clients log in as fast as they can while
+READ_THREADS clients GET /api/event/<id>, against a real threaded server. run once with
+bcrypt on the request threads (HASH_WORKERS=0) and once with the hashing pool, and print
+the p50/p99 of the reads and how many logins were turned away with a 503
+
+    python -m bench.logins
+"""
+import http.client
+import json
+import threading
+import time
+
+import passwords
+from bench import fresh_db, percentile
+
+LOGIN_THREADS = 16
+READ_THREADS = 4
+SECONDS = 5
+
+
+def run(port: int, event_id: int):
+	stop = time.monotonic() + SECONDS
+	reads = []
+	logins = {"ok": 0, "busy": 0}
+	lock = threading.Lock()
+
+	def login():
+		con = http.client.HTTPConnection("127.0.0.1", port)
+		body = json.dumps({"username": "bench", "password": "hunter2"})
+		while time.monotonic() < stop:
+			con.request("POST", "/api/login", body, {"content-type": "application/json"})
+			res = con.getresponse()
+			res.read()
+			with lock:
+				logins["ok" if res.status == 200 else "busy"] += 1
+
+	def read():
+		con = http.client.HTTPConnection("127.0.0.1", port)
+		while time.monotonic() < stop:
+			start = time.perf_counter()
+			con.request("GET", f"/api/event/{event_id}")
+			con.getresponse().read()
+			with lock:
+				reads.append(time.perf_counter() - start)
+
+	threads = [threading.Thread(target=login) for _ in range(LOGIN_THREADS)]
+	threads += [threading.Thread(target=read) for _ in range(READ_THREADS)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return reads, logins
+
+
+def main():
+	fresh_db()
+	from werkzeug.serving import make_server
+	import logging
+	logging.disable(logging.INFO)
+	from app import app
+	from events import Events
+	from user import UsersSlay
+
+	UsersSlay("bench", passwords.hash("hunter2"), "Bench", None, None, None, None, 0, None).create()
+	evt = Events(-1, "bench event", "bench", 1, 2, 0.0, 0.0)
+	evt.create()
+
+	server = make_server("127.0.0.1", 0, app, threaded=True)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	workers = passwords.HASH_WORKERS
+	for name, hash_workers in [("inline", 0), (f"pool of {workers}", workers)]:
+		passwords.HASH_WORKERS = hash_workers
+		reads, logins = run(server.port, evt.id)
+		print(f"{name:<12} reads p50 {percentile(reads, 50) * 1e3:7.1f} ms  p99 {percentile(reads, 99) * 1e3:7.1f} ms"
+			f"  logins ok {logins['ok']}  503 {logins['busy']}")
+	server.shutdown()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,44 @@
+"""
+checks that the per-request sql profiling sees every way the server runs a statement:
+con.execute(), con.executemany(), con.executescript() and the cursor versions. fails if
+any of them goes uncounted
+
+    python -m bench.metrics
+"""
+import sys
+
+import db
+import metrics
+from bench import fresh_db
+
+# (what, how to run one statement on a connection)
+WAYS = [
+	("con.execute", lambda con: con.execute("SELECT 1 FROM users WHERE username = ?", ["bench"]).fetchall()),
+	("con.executemany", lambda con: con.executemany("UPDATE users SET bio = ? WHERE username = ?", [("x", "bench")])),
+	("con.executescript", lambda con: con.executescript("SELECT 1;")),
+	("cursor.execute", lambda con: con.cursor().execute("SELECT 1 FROM users WHERE username = ?", ["bench"]).fetchall()),
+	("cursor.executemany", lambda con: con.cursor().executemany("UPDATE users SET bio = ? WHERE username = ?", [("x", "bench")])),
+]
+
+
+def main() -> int:
+	if not metrics.ENABLED:
+		print("METRICS_ENABLED=0, nothing to check")
+		return 1
+	fresh_db()
+	con = db.get_db()
+	failed = 0
+	for what, run in WAYS:
+		metrics.start_request()
+		run(con)
+		queries = metrics._local.request.queries
+		metrics.finish_request("GET", "/bench", 200)
+		if queries != 1:
+			failed += 1
+			print(f"{what}: counted {queries} statements, not 1")
+	print("ok" if not failed else f"{failed} ways of running a statement aren't counted")
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Events.get_nearby over the events_location r*tree vs the same bounding box as a plain
+WHERE over the events table, on N generated events (1M by default)
+
+    python -m bench.nearby [N]
+"""
+import random
+import sys
+
+import db
+from bench import fresh_db, timeit, report
+from events import Events
+from user import UsersSlay
+
+QUERIES = 200
+
+
+def main(n: int):
+	fresh_db()
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	rng = random.Random(0)
+	with db.get_db() as con:
+		con.executemany("INSERT INTO events (eventName, owner, start, end, location_lat, location_lon) VALUES (?, ?, ?, ?, ?, ?)",
+			((f"event {i}", "bench", 1, 2, rng.uniform(-60, 70), rng.uniform(-180, 180)) for i in range(n)))
+
+	points = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(QUERIES)]
+	it = iter(points * 1000)
+
+	def indexed():
+		lat, lon = next(it)
+		Events.get_nearby(lat, lon, 50)
+
+	def scan():
+		lat, lon = next(it)
+		con = db.get_db()
+		con.execute("SELECT * FROM events WHERE location_lat BETWEEN ? AND ? AND location_lon BETWEEN ? AND ?",
+			[lat - 0.5, lat + 0.5, lon - 0.5, lon + 0.5]).fetchall()
+
+	report(f"r*tree, 50 km, {n} events", timeit(indexed, QUERIES))
+	report(f"table scan, {n} events", timeit(scan, 20))
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,78 @@
+"""
+runs EXPLAIN QUERY PLAN over every SQL string literal in the server modules and
+fails if any of them has to scan a whole table instead of using an index
+
+    python -m bench.queryplan
+"""
+import ast
+import os
+import re
+import sys
+
+import db
+from bench import fresh_db
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["app.py", "events.py", "user.py", "search.py", "Friends.py", "maintenance.py"]
+
+SQL = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\s+\S", re.IGNORECASE)
+
+# statements that are allowed to scan, and why
+ALLOWED = {}
+
+# (module, function) whose statement may scan a materialised subquery, and why. anything
+# else scanning one is flagged like any other scan
+SUBQUERY_SCANS = {
+	("events.py", "get_in_range"): "the UNION of the owned and accepted halves (each an index range) is materialised to drop events that are in both",
+}
+
+
+def queries(module: str):
+	""" (line, function, sql) for every string literal in the module that looks like SQL.
+	function is the name of the def it's in, or None at module level """
+	with open(os.path.join(SERVER, module)) as f:
+		tree = ast.parse(f.read(), module)
+
+	def walk(node, function):
+		for child in ast.iter_child_nodes(node):
+			if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+				yield from walk(child, child.name)
+			elif isinstance(child, ast.Constant) and isinstance(child.value, str) and SQL.match(child.value):
+				yield child.lineno, function, child.value
+			else:
+				yield from walk(child, function)
+
+	yield from walk(tree, None)
+
+
+def scans(con, sql: str, subquery: bool = False):
+	""" the plan steps that walk a whole table. subquery lets a materialised subquery's
+	results be scanned """
+	plan = con.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?")).fetchall()
+	return [
+		detail for _, _, _, detail in plan
+		# a virtual table (fts5, r*tree) is searched through its own index
+		if detail.startswith("SCAN") and not (subquery and detail.startswith("SCAN (subquery-"))
+		and "VIRTUAL TABLE" not in detail and "CONSTANT ROW" not in detail
+	]
+
+
+def main() -> int:
+	fresh_db()
+	con = db.get_db()
+	failed = 0
+	for module in MODULES:
+		for line, function, sql in queries(module):
+			bad = scans(con, sql, (module, function) in SUBQUERY_SCANS)
+			if not bad or sql in ALLOWED:
+				continue
+			failed += 1
+			print(f"{module}:{line}: {' '.join(sql.split())}")
+			for detail in bad:
+				print(f"    {detail}")
+	print("ok" if not failed else f"{failed} queries scan a table")
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+throughput of the read routes through serve.py with 1, 2, 4 ... up to --max workers.
+each level gets a seeded database, the same set of client processes hammering
+GET /api/event/<id>, /api/event/<id>/users, /api/user/<username>, the month calendar and
+search over keep-alive connections for DURATION seconds, and reports requests per second,
+speedup over one worker and latency
+
+    python -m bench.scaling [--max N] [--clients N] [--duration S]
+
+the clients run on the same machine, so leave them cores of their own (or expect the
+curve to flatten early)
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import blobs
+from bench import fresh_db, listen, percentile
+from bench.seed import seed
+
+# keep-alive connections per client process
+THREADS = 4
+DURATION = 10
+MONTH = 30 * 86400 * 1000
+
+
+def paths(rng: random.Random, users: int, events: int):
+	now = int(time.time() * 1000)
+	while True:
+		event = rng.randrange(1, events + 1)
+		user = f"user{rng.randrange(users)}"
+		yield rng.choice([
+			f"/api/event/{event}",
+			f"/api/event/{event}/users",
+			f"/api/user/{user}",
+			f"/api/user/{user}/events?from={now - MONTH // 2}&to={now + MONTH // 2}",
+			f"/api/search?q=event+{event % 100}",
+		])
+
+
+def client(port: int, users: int, events: int, seconds: float, number: int, results):
+	""" one client process: THREADS connections going as fast as they can """
+	import threading
+	latencies = []
+	errors = [0]
+	deadline = time.monotonic() + seconds
+
+	def run(n: int):
+		con = http.client.HTTPConnection("127.0.0.1", port)
+		for path in paths(random.Random(number * 100 + n), users, events):
+			if time.monotonic() > deadline:
+				return
+			start = time.perf_counter()
+			con.request("GET", path)
+			res = con.getresponse()
+			res.read()
+			latencies.append(time.perf_counter() - start)
+			if res.status >= 400:
+				errors[0] += 1
+
+	threads = [threading.Thread(target=run, args=(n,)) for n in range(THREADS)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	results.put((latencies, errors[0]))
+
+
+def wait_for(port: int, timeout: float = 30):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			socket.create_connection(("127.0.0.1", port), 1).close()
+			return
+		except OSError:
+			time.sleep(0.1)
+	raise RuntimeError(f"nothing listening on {port}")
+
+
+def level(workers: int, args, env: dict) -> dict:
+	sock = listen()
+	port = sock.getsockname()[1]
+	sock.close()
+	server = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--log-level", "warning"],
+		env=env, stderr=subprocess.DEVNULL)
+	try:
+		wait_for(port)
+		ctx = multiprocessing.get_context("spawn")
+		results = ctx.Queue()
+		clients = [ctx.Process(target=client, args=(port, args.users, args.events, args.duration, n, results)) for n in range(args.clients)]
+		for process in clients:
+			process.start()
+		latencies, errors = [], 0
+		for _ in clients:
+			samples, failed = results.get()
+			latencies += samples
+			errors += failed
+		for process in clients:
+			process.join()
+	finally:
+		server.send_signal(signal.SIGTERM)
+		server.wait()
+	return {
+		"throughput": len(latencies) / args.duration, "errors": errors,
+		"p50_ms": percentile(latencies, 50) * 1000, "p99_ms": percentile(latencies, 99) * 1000,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="read throughput through serve.py as workers are added")
+	parser.add_argument("--max", type=int, default=os.cpu_count() or 1, help="most workers to try")
+	parser.add_argument("--clients", type=int, default=max(2, os.cpu_count() or 1), help="client processes")
+	parser.add_argument("--duration", type=float, default=DURATION)
+	parser.add_argument("--users", type=int, default=1000)
+	parser.add_argument("--events", type=int, default=5000)
+	args = parser.parse_args()
+
+	path = fresh_db()
+	seed(args.users, args.events, args.events * 4, 0)
+	env = dict(os.environ, DB_PATH=path, BLOB_DIR=blobs.BLOB_DIR, SECRET_KEY="bench", MAINTENANCE_INTERVAL="0")
+
+	counts = []
+	n = 1
+	while n < args.max:
+		counts.append(n)
+		n *= 2
+	counts.append(args.max)
+
+	base = None
+	for workers in counts:
+		result = level(workers, args, env)
+		base = base or result["throughput"]
+		print(f"{workers:>3} workers  {result['throughput']:8.0f} req/s  x{result['throughput'] / base:4.2f}  "
+			f"p50 {result['p50_ms']:6.1f} ms  p99 {result['p99_ms']:6.1f} ms  {result['errors']} errors", flush=True)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,266 @@
+"""
+replay user sessions against a seeded database and write throughput and latency per
+route to json, so runs on different commits can be compared. a session logs in (or
+signs up), loads the dashboard, opens a few events and sometimes invites someone or
+uploads a photo. which users and events get picked follows the seed's zipf skew
+
+    python -m bench.scenarios [--sessions N] [--threads N] [--http] [--out results.json]
+
+by default requests go through flask's test client in this process. --http starts a
+threaded server on a local port instead and talks to it over real sockets (--asgi does
+the same with asgi.py under uvicorn)
+"""
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from bench import fresh_db, listen, percentile
+from bench.seed import PASSWORD, seed
+
+# chances of each optional step in a session
+SIGNUP = 0.05
+INVITE = 0.3
+UPLOAD = 0.1
+# events opened per session
+EVENT_PAGES = 3
+MONTH = 30 * 86400 * 1000
+
+
+class TestClient(object):
+	""" requests through app.test_client(), one per session so cookies don't mix """
+
+	def __init__(self, app):
+		self.client = app.test_client()
+
+	def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> (int, bytes):
+		res = self.client.open(path, method=method, data=body, headers=headers)
+		return res.status_code, res.get_data()
+
+
+class HTTPClient(object):
+	""" requests over a keep-alive connection to a real server """
+
+	def __init__(self, port: int):
+		self.con = http.client.HTTPConnection("127.0.0.1", port)
+		self.cookie = None
+
+	def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> (int, bytes):
+		headers = dict(headers or {})
+		if self.cookie is not None:
+			headers["Cookie"] = self.cookie
+		self.con.request(method, path, body, headers)
+		res = self.con.getresponse()
+		data = res.read()
+		cookie = res.getheader("Set-Cookie")
+		if cookie is not None:
+			self.cookie = cookie.split(";", 1)[0]
+		return res.status, data
+
+
+class Recorder(object):
+	""" latencies per route, and how many came back with an error """
+
+	def __init__(self):
+		self.latencies = {}
+		self.errors = {}
+		self.lock = threading.Lock()
+
+	def call(self, client, route: str, method: str, path: str, body=None, headers=None):
+		start = time.perf_counter()
+		status, data = client.request(method, path, body, headers)
+		elapsed = time.perf_counter() - start
+		# old routes report errors as {"error": ...} with a 200
+		failed = status >= 400 or data.startswith(b'{"error"')
+		with self.lock:
+			self.latencies.setdefault(route, []).append(elapsed)
+			if failed:
+				self.errors[route] = self.errors.get(route, 0) + 1
+		if failed or status != 200 or data[:1] not in (b"{", b"["):
+			return None
+		return json.loads(data)
+
+	def results(self, seconds: float) -> dict:
+		routes = {}
+		for route, samples in sorted(self.latencies.items()):
+			routes[route] = {
+				"requests": len(samples),
+				"errors": self.errors.get(route, 0),
+				"throughput": len(samples) / seconds,
+				"p50_ms": percentile(samples, 50) * 1000,
+				"p95_ms": percentile(samples, 95) * 1000,
+				"p99_ms": percentile(samples, 99) * 1000,
+			}
+		everything = [sample for samples in self.latencies.values() for sample in samples]
+		return {
+			"requests": len(everything),
+			"errors": sum(self.errors.values()),
+			"throughput": len(everything) / seconds,
+			"p50_ms": percentile(everything, 50) * 1000,
+			"p95_ms": percentile(everything, 95) * 1000,
+			"p99_ms": percentile(everything, 99) * 1000,
+			"routes": routes,
+		}
+
+
+def session(client, rec: Recorder, data: dict, rng: random.Random, photo: bytes, number: int):
+	json_headers = {"Content-Type": "application/json"}
+	if rng.random() < SIGNUP:
+		username = f"signup{number}"
+		rec.call(client, "POST /api/user", "POST", "/api/user",
+			json.dumps({"username": username, "password": PASSWORD, "name": username}), json_headers)
+	else:
+		username = data["invitees"].pick(rng)
+	rec.call(client, "POST /api/login", "POST", "/api/login",
+		json.dumps({"username": username, "password": PASSWORD}), json_headers)
+
+	dashboard = rec.call(client, "GET /api/user/me/dashboard", "GET", "/api/user/me/dashboard")
+	# the month around now, like the dashboard's calendar
+	now = int(time.time() * 1000)
+	rec.call(client, "GET /api/user/me/calendar", "GET", f"/api/user/me/calendar?from={now - MONTH // 2}&to={now + MONTH // 2}")
+
+	mine = [event["id"] for event in (dashboard or {}).get("events", []) if event["owner"] == username]
+	for id in {data["popular"].pick(rng) for _ in range(EVENT_PAGES)}:
+		rec.call(client, "GET /api/event/<id>", "GET", f"/api/event/{id}")
+		rec.call(client, "GET /api/event/<id>/users", "GET", f"/api/event/{id}/users")
+		rec.call(client, "GET /api/event/<id>/invitees", "GET", f"/api/event/{id}/invitees")
+		photos = rec.call(client, "GET /api/event/<id>/photos", "GET", f"/api/event/{id}/photos")
+		if photos:
+			rec.call(client, "GET /api/event/<id>/photos/<photoid>", "GET",
+				f"/api/event/{id}/photos/{rng.choice(photos)}?size=thumb")
+
+	if mine and rng.random() < INVITE:
+		id = rng.choice(mine)
+		rec.call(client, "POST /api/event/<id>/users/<username>", "POST",
+			f"/api/event/{id}/users/{data['invitees'].pick(rng)}")
+	if mine and rng.random() < UPLOAD:
+		rec.call(client, "POST /api/event/<id>/photos", "POST", f"/api/event/{rng.choice(mine)}/photos",
+			photo, {"Content-Type": "image/png"})
+	rec.call(client, "GET /api/logout", "GET", "/api/logout")
+
+
+def small_png() -> bytes:
+	from PIL import Image
+	out = io.BytesIO()
+	Image.new("RGB", (640, 480), (200, 120, 40)).save(out, "PNG")
+	return out.getvalue()
+
+
+def serve(mode: str):
+	""" child for --http/--asgi: serve the database in DB_PATH/BLOB_DIR, print the port """
+	sock = listen()
+	if mode == "wsgi":
+		from werkzeug.serving import make_server
+		from app import app
+		# a log line per request would be most of what the server does
+		logging.getLogger("werkzeug").setLevel(logging.WARNING)
+		server = make_server("127.0.0.1", 0, app, threaded=True, fd=sock.fileno())
+		print(sock.getsockname()[1], flush=True)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+	else:
+		import uvicorn
+		from asgi import application
+		print(sock.getsockname()[1], flush=True)
+		uvicorn.Server(uvicorn.Config(application, log_level="warning")).run(sockets=[sock])
+
+
+def main():
+	parser = argparse.ArgumentParser(description="replay user sessions and report latency per route")
+	parser.add_argument("--users", type=int, default=1000)
+	parser.add_argument("--events", type=int, default=5000)
+	parser.add_argument("--invites", type=int, default=20000)
+	parser.add_argument("--photos", type=int, default=2000)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--sessions", type=int, default=500)
+	parser.add_argument("--threads", type=int, default=8)
+	parser.add_argument("--http", action="store_true", help="go through a threaded wsgi server")
+	parser.add_argument("--asgi", action="store_true", help="go through asgi.py under uvicorn")
+	parser.add_argument("--out", default="bench-results.json")
+	args = parser.parse_args()
+
+	import blobs
+	path = fresh_db()
+	data = seed(args.users, args.events, args.invites, args.photos, args.seed)
+	photo = small_png()
+
+	server = None
+	if args.http or args.asgi:
+		env = dict(os.environ, DB_PATH=path, BLOB_DIR=blobs.BLOB_DIR)
+		server = subprocess.Popen([sys.executable, "-m", "bench.scenarios", "serve", "asgi" if args.asgi else "wsgi"],
+			env=env, stdout=subprocess.PIPE, text=True)
+		port = int(server.stdout.readline())
+		make_client = lambda: HTTPClient(port)
+	else:
+		from app import app
+		make_client = lambda: TestClient(app)
+
+	rec = Recorder()
+	numbers = iter(range(args.sessions))
+	lock = threading.Lock()
+
+	def worker(n: int):
+		# each thread has its own rng (and the zipf samplers share the seed's), so the
+		# same arguments replay the same sessions, if not in the same interleaving
+		rng = random.Random(args.seed * 1000 + n)
+		while True:
+			with lock:
+				number = next(numbers, None)
+			if number is None:
+				return
+			session(make_client(), rec, data, rng, photo, number)
+
+	start = time.perf_counter()
+	try:
+		threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	finally:
+		if server is not None:
+			# not terminate(): the server has to exit normally to shut down its resizing pool
+			server.send_signal(signal.SIGINT)
+			server.wait()
+	seconds = time.perf_counter() - start
+
+	results = {
+		"commit": commit(),
+		"mode": "asgi" if args.asgi else "http" if args.http else "test client",
+		"config": {key: value for key, value in vars(args).items() if key not in ("out", "http", "asgi")},
+		"seconds": seconds,
+		**rec.results(seconds),
+	}
+	with open(args.out, "w") as f:
+		json.dump(results, f, indent=2)
+	print(f"{results['requests']} requests in {seconds:.1f}s ({results['throughput']:.0f}/s), "
+		f"p50 {results['p50_ms']:.1f} ms p95 {results['p95_ms']:.1f} ms p99 {results['p99_ms']:.1f} ms, "
+		f"{results['errors']} errors -> {args.out}")
+	for route, stats in results["routes"].items():
+		print(f"  {route:<45} {stats['requests']:>6}  p50 {stats['p50_ms']:7.1f}  p95 {stats['p95_ms']:7.1f}  "
+			f"p99 {stats['p99_ms']:7.1f} ms  {stats['errors']:>4} errors")
+
+
+def commit() -> str:
+	""" the commit being benchmarked, with -dirty if there are local changes """
+	try:
+		return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+if __name__ == "__main__":
+	if sys.argv[1:2] == ["serve"]:
+		serve(sys.argv[2])
+	else:
+		main()
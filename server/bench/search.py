@@ -0,0 +1,51 @@
+"""
+typeahead latency for search.users over N generated users (100k by default), for prefixes
+and for common words typed out in full. the target is under 10 ms
+
+    python -m bench.search [N]
+"""
+import random
+import sys
+
+import db
+import search
+from bench import fresh_db, percentile
+
+SYLLABLES = ["sa", "mu", "el", "ri", "ko", "na", "ta", "li", "jo", "an", "be", "th", "ca", "ro", "mi", "da"]
+WORDS = ["slug", "banana", "hiking", "coffee", "chess", "climbing", "music", "ucsc", "physics", "art", "soccer", "code"]
+
+
+def word(rng):
+	return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def main(n: int):
+	fresh_db()
+	rng = random.Random(0)
+	with db.get_db() as con:
+		con.executemany("INSERT INTO users (username, password, name, bio) VALUES (?, ?, ?, ?)",
+			((f"{word(rng)}{i}", b"x", f"{word(rng).title()} {word(rng).title()}", " ".join(rng.sample(WORDS, 3)))
+				for i in range(n)))
+
+	import time
+	for prefix_len in [1, 2, 3, 5]:
+		samples = []
+		for _ in range(200):
+			q = word(rng)[:prefix_len]
+			start = time.perf_counter()
+			search.users(q)
+			samples.append(time.perf_counter() - start)
+		print(f"{n} users, {prefix_len} letter prefix: p50 {percentile(samples, 50) * 1e3:6.2f} ms  p99 {percentile(samples, 99) * 1e3:6.2f} ms")
+
+	# finished words: every bio has three of WORDS, so each matches about a quarter of the users
+	samples = []
+	for _ in range(200):
+		q = rng.choice(WORDS)
+		start = time.perf_counter()
+		search.users(q)
+		samples.append(time.perf_counter() - start)
+	print(f"{n} users, common whole word: p50 {percentile(samples, 50) * 1e3:6.2f} ms  p99 {percentile(samples, 99) * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,131 @@
+"""
+fill a database with synthetic users, events, invitations and photos. popularity is
+zipf-skewed like real usage: a few users own most events and get most invitations, and
+a few events get most of the invites and photos. the same --seed gives the same data
+
+    python -m bench.seed [--users N] [--events N] [--invites N] [--photos N] [path/to/bench.db]
+
+with no path it makes a fresh database in a temp dir (see bench.fresh_db), otherwise the
+photos go in BLOB_DIR like the server's. every user's password is PASSWORD
+"""
+import argparse
+import io
+import itertools
+import random
+import time
+
+from PIL import Image
+
+import blobs
+import db
+import passwords
+from bench import fresh_db
+from migrate import migrate
+
+PASSWORD = "hunter2"
+# zipf exponent: 0 is uniform, higher piles more onto the first few
+SKEW = 1.1
+DAY = 86400 * 1000
+# events are spread over this many days either side of now
+SPREAD_DAYS = 180
+# photo sizes are lognormal around this many bytes
+PHOTO_SIZE = 16 * 1024
+
+
+class Zipf(object):
+	""" picks items with probability proportional to 1 / rank ** SKEW, after shuffling the
+	items so popularity isn't tied to insertion order """
+
+	def __init__(self, items: list, rng: random.Random, skew: float = SKEW):
+		self.items = list(items)
+		rng.shuffle(self.items)
+		self.cum_weights = list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, len(self.items) + 1)))
+		self.rng = rng
+
+	def pick(self, rng: random.Random = None):
+		return (rng or self.rng).choices(self.items, cum_weights=self.cum_weights)[0]
+
+
+def noise_png(rng: random.Random, size: int) -> bytes:
+	""" a png of random pixels, about size bytes (noise doesn't compress) """
+	side = max(1, int((size / 3) ** 0.5))
+	out = io.BytesIO()
+	Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3)).save(out, "PNG", compress_level=1)
+	return out.getvalue()
+
+
+def username(i: int) -> str:
+	return f"user{i}"
+
+
+def seed(users: int = 1000, events: int = 5000, invites: int = 20000, photos: int = 2000, seed: int = 0) -> dict:
+	""" add the data to the current database (db.DB_PATH) and blob store. returns how many
+	rows of each kind were made and the zipf samplers, for drivers that want the same skew """
+	rng = random.Random(seed)
+	now = int(time.time() * 1000)
+	# every user gets the same hash so seeding doesn't spend minutes in bcrypt
+	hashed = passwords._hash(PASSWORD.encode(), passwords.BCRYPT_ROUNDS)
+	names = [username(i) for i in range(users)]
+	owners = Zipf(names, rng)
+	invitees = Zipf(names, rng)
+
+	with db.get_db() as con:
+		con.executemany("INSERT INTO users (username, password, name, pronouns, bio) VALUES (?, ?, ?, ?, ?)",
+			((name, hashed, f"User {i}", rng.choice([None, "she/her", "he/him", "they/them"]), None)
+			for i, name in enumerate(names)))
+
+		def make_events():
+			for i in range(events):
+				start = now + rng.randint(-SPREAD_DAYS, SPREAD_DAYS) * DAY + rng.randint(8, 20) * 3600 * 1000
+				yield (f"event {i}", owners.pick(), start, start + rng.randint(1, 4) * 3600 * 1000,
+					rng.uniform(-60, 60), rng.uniform(-180, 180))
+		before = con.execute("SELECT coalesce(max(id), 0) FROM events").fetchone()[0]
+		con.executemany("INSERT INTO events (eventName, owner, start, end, location_lat, location_lon) VALUES (?, ?, ?, ?, ?, ?)",
+			make_events())
+		event_ids = [row[0] for row in con.execute("SELECT id FROM events WHERE id > ? ORDER BY id", [before])]
+		popular = Zipf(event_ids, rng)
+
+		def make_invites():
+			for _ in range(invites):
+				yield popular.pick(), invitees.pick(), rng.random() < 0.6
+		con.executemany("INSERT OR IGNORE INTO eventCollab (events, name, accepted) VALUES (?, ?, ?)", make_invites())
+		collabs = con.execute("SELECT count(*) FROM eventCollab").fetchone()[0]
+
+		def make_photos():
+			for _ in range(photos):
+				data = noise_png(rng, max(256, int(rng.lognormvariate(0, 0.8) * PHOTO_SIZE)))
+				yield popular.pick(), blobs.put(data), len(data)
+		# straight in rather than through add_photo_blob, the resized copies get made the
+		# first time something asks for them
+		con.executemany("INSERT INTO photos (eventid, photo, hash, size) VALUES (?, X'', ?, ?)", make_photos())
+
+	db.release_db()
+	return {
+		"users": users, "events": events, "collabs": collabs, "photos": photos,
+		"owners": owners, "invitees": invitees, "popular": popular,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="fill a database with synthetic data")
+	parser.add_argument("path", nargs="?", help="database to add to (default: a fresh temp one)")
+	parser.add_argument("--users", type=int, default=1000)
+	parser.add_argument("--events", type=int, default=5000)
+	parser.add_argument("--invites", type=int, default=20000, help="invitations to try (repeats are dropped)")
+	parser.add_argument("--photos", type=int, default=2000)
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	if args.path:
+		db.set_db_path(args.path)
+		migrate()
+	else:
+		fresh_db()
+	start = time.perf_counter()
+	made = seed(args.users, args.events, args.invites, args.photos, args.seed)
+	print(f"{db.DB_PATH}: {made['users']} users, {made['events']} events, {made['collabs']} invitations, "
+		f"{made['photos']} photos in {time.perf_counter() - start:.1f}s (blobs in {blobs.BLOB_DIR})")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,83 @@
+"""
+the /api/user/<username>/events response for a user with 10k events: the old way (dict
+backed dataclasses built row by row, json.dumps of every __dict__) against slotted Events
+from the row factory and against events.dumps straight from the rows. reports the time to
+fetch and encode, and the peak memory tracemalloc sees while doing it
+"""
+import dataclasses
+import json
+import time
+import tracemalloc
+
+from bench import fresh_db
+
+N = 10_000
+ROUNDS = 5
+
+
+def measure(name: str, build):
+	tracemalloc.start()
+	build()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	times = []
+	for _ in range(ROUNDS):
+		start = time.perf_counter()
+		body = build()
+		times.append(time.perf_counter() - start)
+	print(f"{name:<32} {min(times) * 1000:7.1f} ms  peak {peak / 1024:8.0f} KB  {len(body)} bytes")
+	return body
+
+
+def main():
+	fresh_db()
+	from app import app
+	import events
+	from db import get_db, release_db
+	from events import Events
+	from user import UsersSlay
+
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	with get_db() as con:
+		con.executemany("INSERT INTO events (eventName, owner, start, end, location_lat, location_lon) VALUES (?, ?, ?, ?, ?, ?)",
+			((f"event {i} ☃", "bench", i * 3600_000, i * 3600_000 + 1800_000, 36.97 + i / 1e5, -122.03 - i / 1e5) for i in range(N)))
+	release_db()
+
+	# Events as it was before slots
+	Plain = dataclasses.make_dataclass("Plain", [(field.name, field.type) for field in dataclasses.fields(Events)])
+
+	def old():
+		with get_db() as con:
+			cur = con.cursor()
+			# the columns are spelled out: SELECT * would bring along ones Events doesn't have (modified)
+			cur.execute("SELECT id, eventName, owner, start, end, location_lat, location_lon, version FROM events WHERE owner = ? ORDER BY start, id", ["bench"])
+			return json.dumps([Plain(*row).__dict__ for row in cur.fetchall()])
+
+	def objects():
+		return json.dumps([event.to_dict() for event in Events.get_for_user("bench")])
+
+	def rows():
+		return events.dumps(Events.get_for_user("bench", raw=True))
+
+	expected = measure("dict dataclasses + json.dumps", old)
+	assert measure("slotted Events + to_dict", objects) == expected
+	assert measure("raw rows + events.dumps", rows) == expected
+	release_db()
+
+	client = app.test_client()
+	start = time.perf_counter()
+	for _ in range(ROUNDS):
+		assert client.get("/api/user/bench/events").get_data(as_text=True) == expected
+	print(f"{'GET /api/user/<username>/events':<32} {(time.perf_counter() - start) / ROUNDS * 1000:7.1f} ms")
+
+	sizes = [
+		("dict dataclass", Plain(*range(8))),
+		("slotted Events", Events(*range(8))),
+	]
+	for name, obj in sizes:
+		size = obj.__sizeof__() + (obj.__dict__.__sizeof__() if hasattr(obj, "__dict__") else 0)
+		print(f"{name:<32} {size} bytes per object")
+
+
+if __name__ == "__main__":
+	main()
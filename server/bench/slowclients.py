@@ -0,0 +1,152 @@
+"""
+slow clients downloading a photo: the threaded wsgi server (what `flask run` does) against
+asgi.py under uvicorn. for each level, that many clients start downloading a 4 MB photo
+and read it at 40 KB/s while a probe keeps fetching an event. reports how many downloads
+got their response started within TIMEOUT, the probe's latency, and the server's threads
+and memory at the end
+
+    python -m bench.slowclients
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from bench import listen, percentile
+
+LEVELS = [50, 200, 800]
+# seconds each slow client keeps reading before it hangs up
+DURATION = 5
+# a download (or probe) not started within this many seconds counts as not sustained
+TIMEOUT = 5
+READ_SIZE = 4096
+READ_EVERY = 0.1
+PHOTO_SIZE = 4 * 1024 * 1024
+
+
+def serve(mode: str):
+	""" child: a server with one event and one photo, prints its port """
+	from bench import fresh_db
+	fresh_db()
+	from events import Events
+	from user import UsersSlay
+	from db import get_db, release_db
+	import blobs
+
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	event = Events(-1, "bench event", "bench", 1, 2, 0.0, 0.0)
+	event.create()
+	# straight into the table: it isn't an image, so there's nothing to resize
+	with get_db() as con:
+		con.execute("INSERT INTO photos (eventid, photo, hash, size) VALUES (?, X'', ?, ?)",
+			[event.id, blobs.put(os.urandom(PHOTO_SIZE)), PHOTO_SIZE])
+	release_db()
+
+	sock = listen()
+	print(sock.getsockname()[1], flush=True)
+	if mode == "wsgi":
+		from werkzeug.serving import make_server
+		from app import app
+		make_server("127.0.0.1", 0, app, threaded=True, fd=sock.fileno()).serve_forever()
+	else:
+		import uvicorn
+		from asgi import application
+		config = uvicorn.Config(application, log_level="warning", backlog=2048, timeout_keep_alive=1)
+		uvicorn.Server(config).run(sockets=[sock])
+
+
+def status(pid: int) -> dict:
+	with open(f"/proc/{pid}/status") as f:
+		fields = dict(line.split(":", 1) for line in f)
+	return {"threads": int(fields["Threads"]), "rss_mb": int(fields["VmRSS"].split()[0]) / 1024}
+
+
+async def slow_client(port: int, started: list):
+	try:
+		sock = socket.socket()
+		# a small window, so the server can't just dump the photo into kernel buffers
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, READ_SIZE)
+		sock.setblocking(False)
+		await asyncio.wait_for(asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port)), TIMEOUT)
+		reader, writer = await asyncio.open_connection(sock=sock, limit=READ_SIZE)
+	except (OSError, asyncio.TimeoutError):
+		return
+	try:
+		writer.write(b"GET /api/event/1/photos/1 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+		head = await asyncio.wait_for(reader.read(READ_SIZE), TIMEOUT)
+		if head.startswith(b"HTTP/1.1 200"):
+			started.append(1)
+		deadline = time.monotonic() + DURATION
+		while time.monotonic() < deadline:
+			await asyncio.sleep(READ_EVERY)
+			if not await reader.read(READ_SIZE):
+				break
+	except (OSError, asyncio.TimeoutError):
+		pass
+	finally:
+		writer.close()
+
+
+async def probe(port: int, latencies: list, failures: list, stop: asyncio.Event):
+	while not stop.is_set():
+		start = time.perf_counter()
+		try:
+			reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), TIMEOUT)
+			writer.write(b"GET /api/event/1 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+			await asyncio.wait_for(reader.read(), TIMEOUT)
+			writer.close()
+			latencies.append(time.perf_counter() - start)
+		except (OSError, asyncio.TimeoutError):
+			failures.append(1)
+		await asyncio.sleep(0.05)
+
+
+async def level(port: int, pid: int, n: int) -> dict:
+	started, latencies, failures = [], [], []
+	stop = asyncio.Event()
+	prober = asyncio.ensure_future(probe(port, latencies, failures, stop))
+	clients = [asyncio.ensure_future(slow_client(port, started)) for _ in range(n)]
+	await asyncio.sleep(DURATION - 1)
+	peak = status(pid)
+	await asyncio.gather(*clients)
+	stop.set()
+	await prober
+	return {
+		"sustained": len(started), "probe_p50_ms": percentile(latencies, 50) * 1000,
+		"probe_p99_ms": percentile(latencies, 99) * 1000, "probe_failures": len(failures), **peak,
+	}
+
+
+def run(mode: str):
+	child = subprocess.Popen([sys.executable, "-m", "bench.slowclients", "serve", mode],
+		stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+	try:
+		port = int(child.stdout.readline())
+		time.sleep(1)
+		for n in LEVELS:
+			result = asyncio.run(level(port, child.pid, n))
+			print(f"{mode:<5} {n:>5} clients  {result['sustained']:>5} sustained  "
+				f"probe p50 {result['probe_p50_ms']:7.1f} ms  p99 {result['probe_p99_ms']:7.1f} ms  "
+				f"{result['probe_failures']:>3} failed  {result['threads']:>5} threads  {result['rss_mb']:6.1f} MB", flush=True)
+			time.sleep(1)
+	finally:
+		child.terminate()
+		child.wait()
+
+
+def main():
+	import resource
+	# every level opens this many sockets at once
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+	resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, max(LEVELS) * 2 + 256)), hard))
+	for mode in ("wsgi", "asgi"):
+		run(mode)
+
+
+if __name__ == "__main__":
+	if sys.argv[1:2] == ["serve"]:
+		serve(sys.argv[2])
+	else:
+		main()
@@ -0,0 +1,85 @@
+"""
+peak RSS of the server process while it takes a 20 MB photo upload, through the old
+base64-in-json body and through a raw image/* body. each run gets its own server
+process so the peaks don't mix
+
+    python -m bench.uploads
+"""
+import base64
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+SIZE = 20 * 1024 * 1024
+
+
+def peak_rss() -> int:
+	""" high water mark of this process's resident set, in KiB. ru_maxrss would also count
+	whatever the parent had before the exec, so read it from /proc instead """
+	with open("/proc/self/status") as f:
+		for line in f:
+			if line.startswith("VmHWM:"):
+				return int(line.split()[1])
+
+
+def serve():
+	""" child: start a server with one event, print its port, then print peak rss when stdin closes """
+	from bench import fresh_db
+	fresh_db()
+	from werkzeug.serving import make_server
+	from app import app
+	from events import Events
+	from user import UsersSlay
+
+	UsersSlay("bench", b"x", "Bench", None, None, None, None, 0, None).create()
+	Events(-1, "bench event", "bench", 1, 2, 0.0, 0.0).create()
+
+	server = make_server("127.0.0.1", 0, app)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	print(server.port, peak_rss(), flush=True)
+	sys.stdin.read()
+	print(peak_rss(), flush=True)
+
+
+def run(name: str, send):
+	child = subprocess.Popen([sys.executable, "-m", "bench.uploads", "serve"],
+		stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+	port, before = map(int, child.stdout.readline().split())
+	con = http.client.HTTPConnection("127.0.0.1", port)
+	send(con)
+	res = con.getresponse()
+	assert res.status == 200, res.read()
+	res.read()
+	child.stdin.close()
+	after = int(child.stdout.readline())
+	child.wait()
+	print(f"{name:<20} rss before {before / 1024:6.1f} MiB, peak {after / 1024:8.1f} MiB (+{(after - before) / 1024:.1f} MiB for the upload)")
+
+
+def main():
+	with tempfile.NamedTemporaryFile() as photo:
+		photo.write(os.urandom(SIZE))
+		photo.flush()
+
+		def old(con):
+			with open(photo.name, "rb") as f:
+				body = json.dumps({"data": base64.b64encode(f.read()).decode()})
+			con.request("POST", "/api/event/1/photos", body, {"content-type": "application/json"})
+
+		def raw(con):
+			with open(photo.name, "rb") as f:
+				con.request("POST", "/api/event/1/photos", f, {"content-type": "image/png", "content-length": str(SIZE)})
+
+		run("base64 json", old)
+		run("raw image/*", raw)
+
+
+if __name__ == "__main__":
+	if sys.argv[1:] == ["serve"]:
+		serve()
+	else:
+		main()
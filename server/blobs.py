@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class TooLarge(Exception):
+	""" a streamed blob went over its size limit """
+
+# photos and pfps live here as files named by their sha256, the database only keeps the hash
+BLOB_DIR = os.path.abspath(os.environ.get("BLOB_DIR", "blobs"))
+
+
+def path(hash: str) -> str:
+	""" where the blob with this hash lives (whether or not it exists yet) """
+	return os.path.join(BLOB_DIR, hash[:2], hash)
+
+
+def exists(hash: str) -> bool:
+	return os.path.exists(path(hash))
+
+
+def put(data: bytes) -> str:
+	""" store data, returns its hash. storing the same bytes twice only keeps one file """
+	hash = hashlib.sha256(data).hexdigest()
+	if not touch(hash):
+		_write(hash, [data])
+	return hash
+
+
+def put_stream(stream, max_size: int = None) -> (str, int):
+	""" store everything read from a file-like stream, CHUNK_SIZE at a time so the whole
+	blob is never in memory. returns (hash, size). raises TooLarge (and stores nothing)
+	once more than max_size bytes have been read """
+	os.makedirs(BLOB_DIR, exist_ok=True)
+	hasher = hashlib.sha256()
+	size = 0
+	fd, tmp = tempfile.mkstemp(dir=BLOB_DIR, prefix=".tmp-")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			while chunk := stream.read(CHUNK_SIZE):
+				size += len(chunk)
+				if max_size is not None and size > max_size:
+					raise TooLarge()
+				hasher.update(chunk)
+				f.write(chunk)
+		hash = hasher.hexdigest()
+		if touch(hash):
+			os.unlink(tmp)
+		else:
+			os.makedirs(os.path.dirname(path(hash)), exist_ok=True)
+			os.replace(tmp, path(hash))
+	except BaseException:
+		if os.path.exists(tmp):
+			os.unlink(tmp)
+		raise
+	return hash, size
+
+
+def touch(hash: str) -> bool:
+	""" mark an existing blob as just stored, so maintenance doesn't collect it before the
+	row that will point at it is written. False if there's no such blob (or maintenance has
+	just taken it), and it has to be written """
+	try:
+		os.utime(path(hash))
+		return True
+	except FileNotFoundError:
+		return False
+
+
+def _write(hash: str, chunks):
+	""" write the chunks to a temp file and move it into place, so readers never see half a blob """
+	dest = path(hash)
+	os.makedirs(os.path.dirname(dest), exist_ok=True)
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".tmp-")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			for chunk in chunks:
+				f.write(chunk)
+		os.replace(tmp, dest)
+	except BaseException:
+		os.unlink(tmp)
+		raise
+
+
+def delete(hash: str):
+	try:
+		os.unlink(path(hash))
+	except FileNotFoundError:
+		pass
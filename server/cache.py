@@ -0,0 +1,100 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# set CACHE_ENABLED=0 to always go to the database
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") != "0"
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "4096"))
+# other processes can write to the database too, so nothing is trusted for longer than this
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "30"))
+
+_caches = {}
+# called with (cache name, key) on every invalidation, key None for clear(). serve.py sets
+# it to pass invalidations on to the other worker processes, which apply them with dropped()
+on_invalidate = None
+
+
+class TTLCache(object):
+	""" a bounded LRU cache whose entries also expire after ttl seconds.
+	get() hands out copies, so callers can modify what they get back """
+
+	def __init__(self, name: str, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+		self.name = name
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.enabled = CACHE_ENABLED
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		# bumped by every invalidation, so a load that raced with a write isn't cached
+		self._generation = 0
+		_caches[name] = self
+
+	def get(self, key, load):
+		""" the cached value for key, or load() (cached if it isn't None) """
+		if not self.enabled:
+			return load()
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] > now:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return copy.copy(entry[1])
+			self.misses += 1
+			generation = self._generation
+		value = load()
+		if value is not None:
+			self.put(key, value, generation)
+		return value
+
+	def put(self, key, value, generation=None):
+		with self._lock:
+			if generation is not None and generation != self._generation:
+				return
+			self._entries[key] = (time.monotonic() + self.ttl, copy.copy(value))
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, key):
+		self._drop(key)
+		if on_invalidate is not None:
+			on_invalidate(self.name, key)
+
+	def clear(self):
+		self._drop(None)
+		if on_invalidate is not None:
+			on_invalidate(self.name, None)
+
+	def _drop(self, key):
+		with self._lock:
+			self._generation += 1
+			if key is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(key, None)
+
+
+def clear(name: str):
+	""" empty the cache with this name, if there is one """
+	if name in _caches:
+		_caches[name].clear()
+
+
+def dropped(name: str, key):
+	""" an invalidation from another process: like invalidate() (or clear() if key is None)
+	without passing it on again """
+	if name in _caches:
+		_caches[name]._drop(key)
+
+
+def stats():
+	""" {cache name: {hits, misses, size}} """
+	return {
+		name: {"hits": cache.hits, "misses": cache.misses, "size": len(cache._entries)}
+		for name, cache in _caches.items()
+	}
@@ -1,4 +1,100 @@
+import os
+import queue
 import sqlite3
+import threading
+
+import metrics
+
+# where the database lives; override with the DB_PATH env var or set_db_path()
+DB_PATH = os.environ.get("DB_PATH", "data.db")
+
+# how many idle connections to keep around between requests
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+PRAGMAS = [
+	# has to come before anything touches a new database file. older files keep whatever
+	# they had until maintenance.py --vacuum
+	"PRAGMA auto_vacuum = INCREMENTAL",
+	"PRAGMA journal_mode = WAL",
+	"PRAGMA synchronous = NORMAL",
+	"PRAGMA foreign_keys = ON",
+	"PRAGMA busy_timeout = 5000",
+	"PRAGMA mmap_size = 268435456",
+	"PRAGMA cache_size = -16384",
+	"PRAGMA temp_store = MEMORY",
+]
+
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+	""" open a new tuned connection. most code wants get_db() instead """
+	con = sqlite3.connect(path or DB_PATH, check_same_thread=False,
+		factory=metrics.Connection if metrics.ENABLED else sqlite3.Connection)
+	for pragma in PRAGMAS:
+		con.execute(pragma)
+	return con
+
 
 def get_db() -> sqlite3.Connection:
-	return sqlite3.connect("data.db")
\ No newline at end of file
+	""" the connection leased to this thread, taken from the pool on first use.
+	it stays leased until release_db() (called at the end of every request) """
+	con = getattr(_local, "con", None)
+	if con is None:
+		try:
+			con = _pool.get_nowait()
+		except queue.Empty:
+			con = connect()
+		_local.con = con
+	return con
+
+
+def release_db(exc=None):
+	""" hand this thread's connection back to the pool """
+	con = getattr(_local, "con", None)
+	if con is None:
+		return
+	_local.con = None
+	if con.in_transaction:
+		con.rollback()
+	try:
+		_pool.put_nowait(con)
+	except queue.Full:
+		con.close()
+
+
+def close_all():
+	""" close every pooled connection (and this thread's lease) """
+	release_db()
+	while True:
+		try:
+			_pool.get_nowait().close()
+		except queue.Empty:
+			break
+
+
+def warm(statements=()):
+	""" fill the pool with open connections, each of which has already run (and so has
+	compiled and cached) the given selects. parameters are all bound to NULL """
+	cons = []
+	while len(cons) < POOL_SIZE:
+		con = connect()
+		for sql in statements:
+			try:
+				con.execute(sql, [None] * sql.count("?")).fetchall()
+			except sqlite3.Error:
+				pass
+		cons.append(con)
+	for con in cons:
+		try:
+			_pool.put_nowait(con)
+		except queue.Full:
+			con.close()
+
+
+def set_db_path(path: str):
+	""" point the pool at a different database file """
+	global DB_PATH
+	close_all()
+	DB_PATH = path
@@ -1,7 +1,14 @@
-from dataclasses import dataclass
+import heapq
+import json
+import math
+from dataclasses import dataclass, fields
+from json.encoder import encode_basestring_ascii
 from db import get_db
+import blobs
+import images
+from cache import TTLCache
 
-@dataclass
+@dataclass(slots=True)
 class Events(object):
     id: int
     eventName: str
@@ -10,80 +17,278 @@ class Events(object):
     end: int
     location_lat: float
     location_lon: float
+    version: int = 0
 
     # group chat and photo need to be implemented later
-    
+
+    @staticmethod
+    def from_row(cursor, row):
+        """ row factory for selects of the columns in field order """
+        return Events(*row)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in KEYS}
+
     @staticmethod
     def get_by_user(username: str):
-        l = []
         with get_db() as con:
             cur = con.cursor()
-            cur.execute("SELECT * FROM events WHERE owner = ?", [username])
-            rows = cur.fetchall() or []
-            for res in rows:
-                l.append(Events(*res))
-        return l
+            cur.row_factory = Events.from_row
+            cur.execute("SELECT id, eventName, owner, start, end, location_lat, location_lon, version FROM events WHERE owner = ?", [username])
+            return cur.fetchall()
     
 
     # username is not the owner of the event
     def add_user(self, username: str):
         with get_db() as con:
-            con.execute("INSERT INTO eventCollab (events, name) VALUES (?, ?)", [self.id, username]) 
+            con.execute("INSERT OR IGNORE INTO eventCollab (events, name) VALUES (?, ?)", [self.id, username]) 
 
-    # only append when invitation is accepted FIX THIS
-    def get_by_collabed_user(username: str):
-        ids = []
+    def add_users(self, usernames):
+        """ invite many users at once, in one transaction. returns {username: result} where
+        result is 'invited', 'already invited', 'owner' or 'not found' """
+        usernames = list(dict.fromkeys(usernames))
         with get_db() as con:
             cur = con.cursor()
-            cur.execute("SELECT * FROM eventCollab WHERE name = ? AND accepted = TRUE", [username])
-            res = cur.fetchall() or []
-            for row in res:
-                ids.append(row[0])
-        
-        events = []
-        for id in ids:
-            events.append(Events.get(id))
-        
-        return events
+            cur.execute("SELECT users.username FROM json_each(?) AS names JOIN users ON users.username = names.value",
+                        [json.dumps(usernames)])
+            found = {row[0] for row in cur.fetchall()}
+            cur.execute("SELECT eventCollab.name FROM json_each(?) AS names JOIN eventCollab ON eventCollab.events = ? AND eventCollab.name = names.value",
+                        [json.dumps(usernames), self.id])
+            already = {row[0] for row in cur.fetchall()}
+
+            results = {}
+            for username in usernames:
+                if username not in found:
+                    results[username] = 'not found'
+                elif username == self.owner:
+                    results[username] = 'owner'
+                elif username in already:
+                    results[username] = 'already invited'
+                else:
+                    results[username] = 'invited'
+            cur.executemany("INSERT OR IGNORE INTO eventCollab (events, name) VALUES (?, ?)",
+                            [(self.id, username) for username, result in results.items() if result == 'invited'])
+        return results
+
+    @staticmethod
+    def get_by_collabed_user(username: str, accepted: bool = True):
+        """ events username has been invited to (accepted or not), in one query """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.row_factory = Events.from_row
+            cur.execute("SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM eventCollab JOIN events ON events.id = eventCollab.events WHERE eventCollab.name = ? AND eventCollab.accepted = ?",
+                        [username, accepted])
+            return cur.fetchall()
+
+    @staticmethod
+    def get_many(ids):
+        """ the events with the given ids, in that order. missing ids are skipped """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.row_factory = Events.from_row
+            cur.execute("SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM json_each(?) AS ids JOIN events ON events.id = ids.value ORDER BY ids.key",
+                        [json.dumps(list(ids))])
+            return cur.fetchall()
+
+    @staticmethod
+    def get_for_user(username: str, after=None, limit: int = -1, raw: bool = False):
+        """ events username owns or has accepted, ordered by (start, id).
+        after is the (start, id) of the last event already seen, for paging.
+        raw gives the rows as tuples, for dumps() """
+        if after is None:
+            after = (-(1 << 63), -(1 << 63))
+        with get_db() as con:
+            cur = con.cursor()
+            if not raw:
+                cur.row_factory = Events.from_row
+            cur.execute("""SELECT id, eventName, owner, start, end, location_lat, location_lon, version FROM (
+                    SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM events WHERE owner = ?
+                    UNION ALL
+                    SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM eventCollab JOIN events ON events.id = eventCollab.events WHERE eventCollab.name = ? AND eventCollab.accepted = TRUE
+                ) WHERE (start, id) > (?, ?) ORDER BY start, id LIMIT ?""",
+                        [username, username, after[0], after[1], limit])
+            return cur.fetchall()
+
+    @staticmethod
+    def get_in_range(username: str, start: int, end: int, raw: bool = False):
+        """ events username owns or has accepted that overlap [start, end), ordered by start.
+        raw gives the rows as tuples, for dumps() """
+        with get_db() as con:
+            cur = con.cursor()
+            if not raw:
+                cur.row_factory = Events.from_row
+            cur.execute("""SELECT id, eventName, owner, start, end, location_lat, location_lon, version FROM (
+                    SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM events WHERE owner = ? AND end > ? AND start < ?
+                    UNION
+                    SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM eventCollab JOIN events ON events.id = eventCollab.events WHERE eventCollab.name = ? AND eventCollab.accepted = TRUE AND events.end > ? AND events.start < ?
+                ) ORDER BY start, id""",
+                        [username, start, end, username, start, end])
+            return cur.fetchall()
+
+    @staticmethod
+    def feed_state(username: str):
+        """ (clock, latest, pruned) for username's calendar feed: the sync token to hand out,
+        the stamp of the last change to their calendar (for its etag), and the oldest token
+        that can still be synced from (see migrations/011) """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("""SELECT clock, MAX(
+                    (SELECT COALESCE(MAX(modified), 0) FROM events WHERE owner = ?),
+                    (SELECT COALESCE(MAX(events.modified), 0) FROM eventCollab JOIN events ON events.id = eventCollab.events WHERE eventCollab.name = ? AND eventCollab.accepted = TRUE),
+                    (SELECT COALESCE(MAX(modified), 0) FROM eventsRemoved WHERE username = ?)
+                ), pruned FROM syncState WHERE id = 0""",
+                        [username, username, username])
+            return cur.fetchone()
+
+    @staticmethod
+    def iter_feed(username: str, since: int = None):
+        """ the events in username's calendar (owned or accepted) as raw rows with modified
+        on the end, or only the ones changed after since. yields them straight off the
+        cursor, for streaming """
+        if since is None:
+            since = -(1 << 63)
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("""SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version, events.modified FROM events WHERE owner = ? AND modified > ?
+                UNION ALL
+                SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version, events.modified FROM eventCollab JOIN events ON events.id = eventCollab.events WHERE eventCollab.name = ? AND eventCollab.accepted = TRUE AND events.modified > ?""",
+                        [username, since, username, since])
+            yield from cur
+
+    @staticmethod
+    def iter_removed(username: str, since: int):
+        """ (id, modified) for events that have left username's calendar since since, and
+        haven't come back """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("""SELECT eventsRemoved.id, eventsRemoved.modified FROM eventsRemoved WHERE eventsRemoved.username = ? AND eventsRemoved.modified > ?
+                AND NOT EXISTS (SELECT 1 FROM events WHERE events.id = eventsRemoved.id AND events.owner = eventsRemoved.username)
+                AND NOT EXISTS (SELECT 1 FROM eventCollab WHERE eventCollab.events = eventsRemoved.id AND eventCollab.name = eventsRemoved.username AND eventCollab.accepted = TRUE)""",
+                        [username, since])
+            yield from cur
+
+    @staticmethod
+    def find_conflicts(events):
+        """ [(id, id)] for every pair of overlapping events. events have to be sorted by start.
+        one sweep, keeping a heap of the events still going at each start """
+        conflicts = []
+        active = []
+        for event in events:
+            while active and active[0][0] <= event.start:
+                heapq.heappop(active)
+            for _, id in active:
+                conflicts.append((id, event.id))
+            heapq.heappush(active, (event.end, event.id))
+        return conflicts
+
+    @staticmethod
+    def get_collaborators(ids):
+        """ {event id: {'attendees': [...], 'invitees': [...]}} for every id, in one query """
+        collaborators = {id: {'attendees': [], 'invitees': []} for id in ids}
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("SELECT events, name, accepted FROM json_each(?) AS ids JOIN eventCollab ON eventCollab.events = ids.value",
+                        [json.dumps(list(ids))])
+            for id, name, accepted in cur.fetchall():
+                collaborators[id]['attendees' if accepted else 'invitees'].append(name)
+        return collaborators
+
+    @staticmethod
+    def get_nearby(lat: float, lon: float, radius: float, limit: int = 50):
+        """ [(event, distance in km)] for events within radius km of (lat, lon), nearest first.
+        the bounding box comes off the events_location r*tree, then the corners get trimmed """
+        dlat = radius / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(lat))
+        dlon = 180 if cos_lat < 1e-6 else min(180, radius / (KM_PER_DEGREE * cos_lat))
+        min_lat, max_lat = max(-90, lat - dlat), min(90, lat + dlat)
+
+        # boxes that run off one side of the antimeridian wrap around to the other
+        lon_ranges = [(max(-180, lon - dlon), min(180, lon + dlon))]
+        if lon - dlon < -180:
+            lon_ranges.append((lon - dlon + 360, 180))
+        if lon + dlon > 180:
+            lon_ranges.append((-180, lon + dlon - 360))
+
+        found = {}
+        with get_db() as con:
+            cur = con.cursor()
+            cur.row_factory = Events.from_row
+            for min_lon, max_lon in lon_ranges:
+                cur.execute("SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version FROM events_location JOIN events ON events.id = events_location.id WHERE events_location.min_lat >= ? AND events_location.max_lat <= ? AND events_location.min_lon >= ? AND events_location.max_lon <= ?",
+                            [min_lat, max_lat, min_lon, max_lon])
+                for event in cur.fetchall():
+                    distance = haversine(lat, lon, event.location_lat, event.location_lon)
+                    if distance <= radius:
+                        found[event.id] = (event, distance)
+        return heapq.nsmallest(limit, found.values(), key=lambda found: found[1])
 
     def get_photo(self, id):
+        """ the blob hash of one of this event's photos, or None if it doesn't exist """
         with get_db() as con:
             cur = con.cursor()
-            cur.execute("SELECT photo FROM photos WHERE eventid = ? AND id = ?", [self.id, id])
+            cur.execute("SELECT hash FROM photos WHERE eventid = ? AND id = ?", [self.id, id])
             res = cur.fetchone()
-            if res is not None: return res[0]
-        return photolist
+            if res is None: return None
+            if res[0] is not None: return res[0]
+        return Events.move_photo_out(id)
 
     def get_photos(self):
-        photolist = []
+        """ the blob hashes of all of this event's photos """
         with get_db() as con:
             cur = con.cursor()
-            cur.execute("SELECT photo FROM photos WHERE eventid = ?", [self.id])
+            cur.execute("SELECT id, hash FROM photos WHERE eventid = ?", [self.id])
             rows = cur.fetchall()
-            for i in rows:
-                photolist.append(i)
-        return photolist
+        return [hash if hash is not None else Events.move_photo_out(id) for id, hash in rows]
 
     def add_photo(self, data):
+        return self.add_photo_blob(blobs.put(data), len(data))
+
+    def add_photo_blob(self, hash, size):
+        """ add a photo that is already in the blob store """
+        with get_db() as con:
+            cur = con.cursor()
+            cur.execute("INSERT INTO photos (eventid, photo, hash, size) VALUES (?, X'', ?, ?) RETURNING id", [self.id, hash, size])
+            id = cur.fetchone()[0]
+        images.generate(hash)
+        return id
+
+    @staticmethod
+    def move_photo_out(id):
+        """ move a photo still stored in the photos.photo column into the blob store """
         with get_db() as con:
             cur = con.cursor()
-            cur.execute("INSERT INTO photos (eventid, photo) VALUES (?, ?) RETURNING id", [self.id, data])
-            return cur.fetchone()[0]
+            cur.execute("SELECT photo FROM photos WHERE id = ?", [id])
+            data = cur.fetchone()[0]
+            hash = blobs.put(data)
+            cur.execute("UPDATE photos SET photo = X'', hash = ?, size = ? WHERE id = ?", [hash, len(data), id])
+        return hash
 
+    @staticmethod
     def delete_photo(id):
+        # the file stays in the blob store, other photos may have the same contents.
+        # maintenance.py deletes it once nothing does
         with get_db() as con:
             con.execute("DELETE FROM photos WHERE id = ?", [id])
 
 
     @staticmethod
     def get(id: int):
+        """ the event, or None. id can be the string from the url: it's keyed by its int
+        value so /api/event/01 and /api/event/1 are one entry, and invalidate() reaches both """
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+        return _cache.get(id, lambda: Events.load(id))
+
+    @staticmethod
+    def load(id: int):
+        """ get, skipping the cache """
         with get_db() as con:
             cur = con.cursor()
-            cur.execute("SELECT * FROM events WHERE id = ?", [id])
-            res = cur.fetchone()
-            if res is not None:
-                return Events(*res)
-        return None
+            cur.row_factory = Events.from_row
+            cur.execute("SELECT id, eventName, owner, start, end, location_lat, location_lon, version FROM events WHERE id = ?", [id])
+            return cur.fetchone()
 
     def create(self):
         with get_db() as con:
@@ -91,13 +296,50 @@ class Events(object):
             res = cur.execute("INSERT INTO events (eventName, owner, start, end, location_lat, location_lon) VALUES (?, ?, ?, ?, ?, ?) RETURNING id",
                         (self.eventName, self.owner, self.start, self.end, self.location_lat, self.location_lon))
             self.id = res.fetchone()[0]
+        _cache.invalidate(self.id)
 
 
     def update(self):
         with get_db() as con:
-            con.execute("UPDATE events SET eventName = ?, owner = ?, start = ?, end = ?, location_lat = ?, location_lon = ? WHERE id = ?",
+            con.execute("UPDATE events SET eventName = ?, owner = ?, start = ?, end = ?, location_lat = ?, location_lon = ?, version = version + 1 WHERE id = ?",
                     (self.eventName, self.owner, self.start, self.end, self.location_lat, self.location_lon, self.id))
+        self.version += 1
+        _cache.invalidate(self.id)
 
     def delete(self):
         with get_db() as con:
             con.execute("DELETE FROM events WHERE id = ?", [self.id])
+        _cache.invalidate(self.id)
+
+
+_cache = TTLCache("events")
+
+# the json keys, in column order
+KEYS = tuple(field.name for field in fields(Events))
+_TEMPLATE = '{"id": %d, "eventName": %s, "owner": %s, "start": %d, "end": %d, "location_lat": %r, "location_lon": %r, "version": %d}'
+
+
+def _encode(row) -> str:
+    id, eventName, owner, start, end, lat, lon, version = row
+    # the template only covers the types the columns normally hold. anything else (a null
+    # location, a nan, an int where a float goes) goes through json.dumps
+    if (type(eventName) is str and type(owner) is str and type(start) is int and type(end) is int
+            and type(lat) is float and type(lon) is float and lat - lat == 0 and lon - lon == 0):
+        return _TEMPLATE % (id, encode_basestring_ascii(eventName), encode_basestring_ascii(owner), start, end, lat, lon, version)
+    return json.dumps(dict(zip(KEYS, row)))
+
+
+def dumps(rows) -> str:
+    """ json for a list of raw event rows (get_for_user(..., raw=True) and friends), the same
+    text json.dumps([event.to_dict(), ...]) gives but without making objects or dicts """
+    return "[" + ", ".join([_encode(row) for row in rows]) + "]"
+
+EARTH_RADIUS = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ great-circle distance in km """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
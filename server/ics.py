@@ -0,0 +1,101 @@
+"""
+iCalendar (RFC 5545) for the calendar feed, /api/user/<username>/calendar.ics. the feed is
+written as it's read off the cursor, CHUNK_SIZE bytes at a time, so a big calendar never
+has to be in memory whole.
+
+with a sync token (?since=) only what changed after it is sent: events that were added or
+changed, and events that left the calendar as cancelled VEVENTs with just their UID
+"""
+import datetime
+
+PRODID = "-//planner//calendar feed//EN"
+# bytes of the body handed to the server at a time
+CHUNK_SIZE = 16 * 1024
+# content lines longer than this many bytes are folded (RFC 5545 3.1)
+LINE_LIMIT = 75
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ESCAPES = str.maketrans({"\\": "\\\\", ";": "\\;", ",": "\\,", "\n": "\\n", "\r": None})
+
+
+def text(value: str) -> str:
+	""" escape a TEXT value """
+	return value.translate(_ESCAPES)
+
+
+def timestamp(ms: int) -> str:
+	""" a UTC DATE-TIME from ms since the epoch, clamped to the years iCalendar can write """
+	try:
+		moment = _EPOCH + datetime.timedelta(milliseconds=ms)
+	except OverflowError:
+		moment = datetime.datetime.max if ms > 0 else datetime.datetime.min
+	return f"{moment.year:04d}{moment.month:02d}{moment.day:02d}T{moment.hour:02d}{moment.minute:02d}{moment.second:02d}Z"
+
+
+def fold(line: str) -> bytes:
+	""" a content line as utf-8 with its CRLF, folded so no physical line is over LINE_LIMIT
+	bytes. folds never split a character """
+	data = line.encode()
+	if len(data) <= LINE_LIMIT:
+		return data + b"\r\n"
+	parts = []
+	start = 0
+	# continuation lines start with a space, which counts towards the limit
+	limit = LINE_LIMIT
+	while len(data) - start > limit:
+		end = start + limit
+		# back up off utf-8 continuation bytes
+		while data[end] & 0xC0 == 0x80:
+			end -= 1
+		parts.append(data[start:end])
+		start = end
+		limit = LINE_LIMIT - 1
+	parts.append(data[start:])
+	return b"\r\n ".join(parts) + b"\r\n"
+
+
+def event(row, host: str) -> bytes:
+	""" a VEVENT from a raw row of Events.iter_feed """
+	id, eventName, owner, start, end, lat, lon, version, modified = row
+	lines = [
+		"BEGIN:VEVENT",
+		f"UID:event-{id}@{host}",
+		f"DTSTAMP:{timestamp(modified)}",
+		f"LAST-MODIFIED:{timestamp(modified)}",
+		f"DTSTART:{timestamp(start)}",
+		f"DTEND:{timestamp(end)}",
+		f"SEQUENCE:{version}",
+		f"SUMMARY:{text(eventName)}",
+		f"X-PLANNER-OWNER:{text(owner)}",
+	]
+	if lat is not None and lon is not None:
+		lines.append(f"GEO:{float(lat)!r};{float(lon)!r}")
+	lines.append("END:VEVENT")
+	return b"".join([fold(line) for line in lines])
+
+
+def cancelled(id: int, modified: int, host: str) -> bytes:
+	""" a VEVENT telling a syncing client to drop an event """
+	return (f"BEGIN:VEVENT\r\nUID:event-{id}@{host}\r\nDTSTAMP:{timestamp(modified)}\r\n"
+		f"STATUS:CANCELLED\r\nEND:VEVENT\r\n").encode()
+
+
+def calendar(name: str, host: str, rows, removed=()):
+	""" the whole VCALENDAR, as chunks of about CHUNK_SIZE bytes. rows are Events.iter_feed
+	rows, removed is (id, modified) pairs from Events.iter_removed """
+	buffer = bytearray(b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+	buffer += fold(f"PRODID:{PRODID}")
+	buffer += b"CALSCALE:GREGORIAN\r\n"
+	buffer += fold(f"X-WR-CALNAME:{text(name)}")
+	for row in rows:
+		buffer += event(row, host)
+		if len(buffer) >= CHUNK_SIZE:
+			yield bytes(buffer)
+			buffer.clear()
+	for id, modified in removed:
+		buffer += cancelled(id, modified, host)
+		if len(buffer) >= CHUNK_SIZE:
+			yield bytes(buffer)
+			buffer.clear()
+	buffer += b"END:VCALENDAR\r\n"
+	yield bytes(buffer)
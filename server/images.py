@@ -0,0 +1,140 @@
+import collections
+import functools
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import blobs
+
+try:
+	from PIL import Image, features
+except ImportError:
+	Image = None
+
+# resized copies made of every photo and pfp, by name -> longest side in pixels
+SIZES = {
+	"thumb": 256,
+	"medium": 1024,
+}
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# blobs that couldn't be resized (not an image pillow can read) are remembered, up to this
+# many, so they're served as they are instead of going back to the pool on every view
+MAX_FAILED = 10_000
+
+# (PIL format, file extension, mimetype) of the resized copies
+if Image is not None and features.check("webp"):
+	VARIANT_FORMAT = ("WEBP", ".webp", "image/webp")
+else:
+	VARIANT_FORMAT = ("JPEG", ".jpg", "image/jpeg")
+
+MAGIC = [
+	(b"\x89PNG\r\n\x1a\n", "image/png"),
+	(b"\xff\xd8\xff", "image/jpeg"),
+	(b"GIF87a", "image/gif"),
+	(b"GIF89a", "image/gif"),
+	(b"BM", "image/bmp"),
+]
+
+_executor = None
+_pending = set()
+# hash -> None, oldest first
+_failed = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4096)
+def mimetype(hash: str) -> str:
+	""" what kind of image the blob is, going by its first few bytes. blobs never change so this is cached """
+	with open(blobs.path(hash), "rb") as f:
+		head = f.read(12)
+	if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+		return "image/webp"
+	for magic, type in MAGIC:
+		if head.startswith(magic):
+			return type
+	return "application/octet-stream"
+
+
+def variant_path(hash: str, size: str, blob_dir: str = None) -> str:
+	return os.path.join(blob_dir or blobs.BLOB_DIR, "variants", size, hash[:2], hash + VARIANT_FORMAT[1])
+
+
+def get_variant(hash: str, size: str):
+	""" (path, mimetype) of a resized copy, or None if it isn't made yet (asking for it starts
+	making it) or can't be made """
+	path = variant_path(hash, size)
+	if os.path.exists(path):
+		return path, VARIANT_FORMAT[2]
+	generate(hash)
+	return None
+
+
+def generate(hash: str):
+	""" make the resized copies of a blob in the background, unless that's already happening """
+	if Image is None:
+		return
+	global _executor
+	with _lock:
+		if hash in _pending or hash in _failed:
+			return
+		if _executor is None:
+			_executor = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+		try:
+			future = _executor.submit(_make_variants, blobs.path(hash), hash, blobs.BLOB_DIR)
+		except RuntimeError as e:
+			# the original is still there to serve, so don't fail the upload over this
+			logging.warning("couldn't queue resizing %s: %s", hash, e)
+			return
+		_pending.add(hash)
+	future.add_done_callback(functools.partial(_done, hash))
+
+
+def shutdown():
+	""" stop the pool and wait for its processes to exit. it starts again if it's needed """
+	global _executor
+	with _lock:
+		executor, _executor = _executor, None
+	if executor is not None:
+		executor.shutdown(wait=True)
+
+
+def _done(hash, future):
+	error = future.exception()
+	with _lock:
+		_pending.discard(hash)
+		# a pool that died (or was shut down) says nothing about the image, it's tried again
+		if error is not None and not isinstance(error, BrokenProcessPool):
+			_failed[hash] = None
+			if len(_failed) > MAX_FAILED:
+				_failed.popitem(last=False)
+	if error is not None:
+		logging.warning("couldn't resize %s: %s", hash, error)
+
+
+def _make_variants(src: str, hash: str, blob_dir: str):
+	""" runs in the pool """
+	format, _, _ = VARIANT_FORMAT
+	with Image.open(src) as img:
+		img.load()
+		for size, px in SIZES.items():
+			dest = variant_path(hash, size, blob_dir)
+			if os.path.exists(dest):
+				continue
+			copy = img.copy()
+			copy.thumbnail((px, px))
+			if format == "JPEG" and copy.mode not in ("RGB", "L"):
+				copy = copy.convert("RGB")
+			os.makedirs(os.path.dirname(dest), exist_ok=True)
+			fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".tmp-")
+			try:
+				with os.fdopen(fd, "wb") as f:
+					copy.save(f, format, quality=80)
+				os.replace(tmp, dest)
+			except BaseException:
+				os.unlink(tmp)
+				raise
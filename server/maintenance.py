@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+garbage collection for things nothing points at any more: photos and invitations of
+events that are gone (databases from before foreign_keys was turned on never cascaded),
+pfps no user has as their pfp, blob store files (and their resized copies) no photo
+or pfp row has the hash of, and calendar feed removals older than SYNC_KEEP. afterwards
+the freed pages are handed back to the filesystem with incremental vacuum, a few at a
+time so requests can still write in between
+
+the server runs a pass every MAINTENANCE_INTERVAL seconds in a background thread. to run
+one by hand:
+
+    python maintenance.py [--vacuum] [path/to/data.db]
+
+incremental vacuum only works on databases made with auto_vacuum = INCREMENTAL (see
+db.PRAGMAS). --vacuum converts an older one with a full VACUUM, which locks the
+database while it runs
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import blobs
+import db
+import images
+
+# seconds between passes in the server, 0 to not run them there
+MAINTENANCE_INTERVAL = int(os.environ.get("MAINTENANCE_INTERVAL", "3600"))
+# rows looked at (and at most deleted) per transaction
+BATCH = 500
+# pages incremental_vacuum frees per transaction
+VACUUM_STEP = 256
+# seconds to sleep between transactions, so request traffic gets the write lock
+PAUSE = 0.01
+# blob files younger than this are left alone: an upload writes its blob before the row
+# pointing at it
+BLOB_GRACE = 3600
+# seconds the calendar feed remembers events leaving someone's calendar. a sync token older
+# than this gets a 410 and the whole feed again
+SYNC_KEEP = int(os.environ.get("SYNC_KEEP", str(30 * 86400)))
+
+_thread = None
+
+
+def _batches(con, select: str, delete: str) -> int:
+	""" walk a table by rowid with select (params: last rowid, BATCH), deleting the rowids
+	it returns with delete (param: json list of them). returns how many went """
+	last = deleted = 0
+	while True:
+		with con:
+			ids = [row[0] for row in con.execute(select, [last, BATCH])]
+			if not ids:
+				return deleted
+			con.execute(delete, [json.dumps(ids)])
+		deleted += len(ids)
+		last = ids[-1]
+		time.sleep(PAUSE)
+
+
+def delete_orphans(con) -> dict:
+	""" remove photos, invitations and pfps nothing references, BATCH at a time """
+	return {
+		"photos": _batches(con,
+			"SELECT photos.id FROM photos WHERE photos.id > ? AND NOT EXISTS (SELECT 1 FROM events WHERE events.id = photos.eventid) ORDER BY photos.id LIMIT ?",
+			"DELETE FROM photos WHERE id IN (SELECT value FROM json_each(?))"),
+		"collabs": _batches(con,
+			"SELECT eventCollab.rowid FROM eventCollab WHERE eventCollab.rowid > ? AND (NOT EXISTS (SELECT 1 FROM events WHERE events.id = eventCollab.events) OR NOT EXISTS (SELECT 1 FROM users WHERE users.username = eventCollab.name)) ORDER BY eventCollab.rowid LIMIT ?",
+			"DELETE FROM eventCollab WHERE rowid IN (SELECT value FROM json_each(?))"),
+		# pfp 0 is the default every new user points at. UsersSlay.set_pfp adds a pfp and
+		# points the user at it in one transaction, so a new pfp is never seen unreferenced
+		"pfps": _batches(con,
+			"SELECT pfps.id FROM pfps WHERE pfps.id > ? AND pfps.id != 0 AND NOT EXISTS (SELECT 1 FROM users WHERE users.pfp = pfps.id) ORDER BY pfps.id LIMIT ?",
+			"DELETE FROM pfps WHERE id IN (SELECT value FROM json_each(?))"),
+	}
+
+
+def prune_removed(con) -> int:
+	""" forget the calendar feed's removals older than SYNC_KEEP, BATCH at a time. tokens
+	from before then are turned away first, so none is synced from a list with holes in it """
+	cutoff = int((time.time() - SYNC_KEEP) * 1000)
+	with con:
+		con.execute("UPDATE syncState SET pruned = MAX(pruned, ?) WHERE id = 0", [cutoff])
+	deleted = 0
+	while True:
+		with con:
+			count = con.execute("DELETE FROM eventsRemoved WHERE rowid IN (SELECT rowid FROM eventsRemoved WHERE modified < ? LIMIT ?)",
+				[cutoff, BATCH]).rowcount
+		deleted += count
+		if count < BATCH:
+			return deleted
+		time.sleep(PAUSE)
+
+
+# which of a json list of hashes a photo or pfp has
+_USED = "SELECT value FROM json_each(?) WHERE EXISTS (SELECT 1 FROM photos WHERE photos.hash = value) OR EXISTS (SELECT 1 FROM pfps WHERE pfps.hash = value)"
+
+
+def _remove_blob(con, folder: str, hash: str, cutoff: float) -> bool:
+	""" unlink a blob that looked unused when the folder was listed, unless it's been stored
+	again since. it's moved aside first: an upload touching it after that finds it gone and
+	writes it again (blobs.touch), one that touched it before shows in its mtime, and one
+	that got as far as its row shows in the database """
+	file = os.path.join(folder, hash)
+	# named like a crashed upload's temp file, so a pass that dies here has it collected next time
+	aside = os.path.join(folder, ".tmp-gc-" + hash)
+	try:
+		os.rename(file, aside)
+	except FileNotFoundError:
+		return False
+	keep = os.stat(aside).st_mtime >= cutoff
+	if not keep:
+		with con:
+			keep = con.execute(_USED, [json.dumps([hash])]).fetchone() is not None
+	if keep:
+		# if an upload wrote it again meanwhile, this puts back the same bytes
+		os.rename(aside, file)
+		return False
+	os.unlink(aside)
+	return True
+
+
+def delete_blobs(con) -> (int, int):
+	""" remove blob files (and resized copies) older than BLOB_GRACE that no photo or pfp
+	has the hash of, plus temp files left by crashed uploads. returns (files, bytes) """
+	files = size = 0
+	cutoff = time.time() - BLOB_GRACE
+	if not os.path.isdir(blobs.BLOB_DIR):
+		return files, size
+	for prefix in sorted(os.listdir(blobs.BLOB_DIR)):
+		folder = os.path.join(blobs.BLOB_DIR, prefix)
+		if prefix == "variants" or not os.path.isdir(folder):
+			continue
+		old = {}
+		with os.scandir(folder) as entries:
+			for entry in entries:
+				stat = entry.stat()
+				if stat.st_mtime < cutoff:
+					old[entry.name] = stat.st_size
+		if not old:
+			continue
+		hashes = [name for name in old if not name.startswith(".tmp-")]
+		with con:
+			used = {row[0] for row in con.execute(_USED, [json.dumps(hashes)])}
+		for name, length in old.items():
+			if name in used:
+				continue
+			if name.startswith(".tmp-"):
+				try:
+					os.unlink(os.path.join(folder, name))
+				except FileNotFoundError:
+					continue
+			elif not _remove_blob(con, folder, name, cutoff):
+				continue
+			files += 1
+			size += length
+			if not name.startswith(".tmp-"):
+				for variant in images.SIZES:
+					try:
+						path = images.variant_path(name, variant)
+						length = os.path.getsize(path)
+						os.unlink(path)
+					except FileNotFoundError:
+						continue
+					files += 1
+					size += length
+	return files, size
+
+
+def vacuum(con) -> int:
+	""" give free pages back to the filesystem, VACUUM_STEP at a time. returns bytes freed """
+	page_size = con.execute("PRAGMA page_size").fetchone()[0]
+	if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+		free = con.execute("PRAGMA freelist_count").fetchone()[0]
+		if free:
+			logging.info("maintenance: %d free pages stay in the database file, run maintenance.py --vacuum to enable incremental vacuum", free)
+		return 0
+	freed = 0
+	while True:
+		free = con.execute("PRAGMA freelist_count").fetchone()[0]
+		if not free:
+			break
+		# execute() only steps the pragma once, which frees a single page
+		con.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP})")
+		left = con.execute("PRAGMA freelist_count").fetchone()[0]
+		if left >= free:
+			break
+		freed += (free - left) * page_size
+		time.sleep(PAUSE)
+	# the pages are only out of the file once the wal is checkpointed
+	con.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+	return freed
+
+
+def run() -> dict:
+	""" one full pass. returns what went and how long it took """
+	start = time.perf_counter()
+	con = db.get_db()
+	try:
+		report = delete_orphans(con)
+		report["removals"] = prune_removed(con)
+		report["blob_files"], report["blob_bytes"] = delete_blobs(con)
+		report["db_bytes"] = vacuum(con)
+	finally:
+		db.release_db()
+	report["seconds"] = time.perf_counter() - start
+	return report
+
+
+def _loop():
+	while True:
+		time.sleep(MAINTENANCE_INTERVAL)
+		try:
+			report = run()
+		except Exception:
+			logging.exception("maintenance pass failed")
+			continue
+		logging.info("maintenance: deleted %d photos, %d invitations, %d pfps, %d calendar removals, %d blob files; reclaimed %d bytes of blobs and %d of database in %.2fs",
+			report["photos"], report["collabs"], report["pfps"], report["removals"], report["blob_files"], report["blob_bytes"], report["db_bytes"], report["seconds"])
+
+
+def start():
+	""" run a pass every MAINTENANCE_INTERVAL seconds in a daemon thread (once per process) """
+	global _thread
+	if MAINTENANCE_INTERVAL <= 0 or _thread is not None:
+		return
+	_thread = threading.Thread(target=_loop, name="maintenance", daemon=True)
+	_thread.start()
+
+
+def main(args):
+	from migrate import migrate
+	full = "--vacuum" in args
+	args = [arg for arg in args if arg != "--vacuum"]
+	if args:
+		db.set_db_path(args[0])
+	migrate()
+	if full:
+		began = time.perf_counter()
+		con = db.get_db()
+		con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+		con.execute("VACUUM")
+		print(f"vacuumed, incremental vacuum is on ({time.perf_counter() - began:.2f}s)")
+	report = run()
+	print(f"deleted {report['photos']} photos, {report['collabs']} invitations, {report['pfps']} pfps, {report['removals']} calendar removals, {report['blob_files']} blob files")
+	print(f"reclaimed {report['blob_bytes']} bytes of blobs and {report['db_bytes']} bytes of database in {report['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,232 @@
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import cache
+
+# set METRICS_ENABLED=0 to skip all of this. connections are then plain sqlite3 ones and
+# no request hooks are installed, so it costs nothing
+ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+# a request running the same statement more times than this gets logged as a likely N+1
+N_PLUS_ONE = int(os.environ.get("N_PLUS_ONE", "10"))
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [100, 1000, 10_000, 100_000, 1_000_000, 10_000_000]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class Histogram(object):
+	""" prometheus-style: counts per bucket upper bound, plus sum and count """
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value):
+		i = 0
+		while i < len(self.buckets) and value > self.buckets[i]:
+			i += 1
+		self.counts[i] += 1
+		self.sum += value
+		self.count += 1
+
+
+class _Request(object):
+	""" what one request did with the database so far """
+	__slots__ = ("start", "queries", "sql_time", "opened", "statements")
+
+	def __init__(self):
+		self.start = time.perf_counter()
+		self.queries = 0
+		self.sql_time = 0.0
+		self.opened = 0
+		self.statements = collections.Counter()
+
+
+# (route, method) -> Histogram etc. only touched with _lock held
+_latency = collections.defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+_sizes = collections.defaultdict(lambda: Histogram(SIZE_BUCKETS))
+_queries = collections.defaultdict(lambda: Histogram(QUERY_BUCKETS))
+_sql_time = collections.Counter()
+_requests = collections.Counter()
+_n_plus_one = collections.Counter()
+_opened = collections.Counter()
+
+
+class Cursor(sqlite3.Cursor):
+	""" counts and times statements for the request running on this thread. fetching is
+	timed too, since that's where sqlite does most of a select's work (iterating the
+	cursor directly isn't) """
+
+	def execute(self, sql, parameters=()):
+		start = time.perf_counter()
+		try:
+			return super().execute(sql, parameters)
+		finally:
+			_record(sql, time.perf_counter() - start)
+
+	def executemany(self, sql, parameters):
+		start = time.perf_counter()
+		try:
+			return super().executemany(sql, parameters)
+		finally:
+			_record(sql, time.perf_counter() - start)
+
+	def executescript(self, sql):
+		start = time.perf_counter()
+		try:
+			return super().executescript(sql)
+		finally:
+			_record(sql, time.perf_counter() - start)
+
+	def fetchone(self):
+		start = time.perf_counter()
+		try:
+			return super().fetchone()
+		finally:
+			_record(None, time.perf_counter() - start)
+
+	def fetchmany(self, size=None):
+		start = time.perf_counter()
+		try:
+			return super().fetchmany(self.arraysize if size is None else size)
+		finally:
+			_record(None, time.perf_counter() - start)
+
+	def fetchall(self):
+		start = time.perf_counter()
+		try:
+			return super().fetchall()
+		finally:
+			_record(None, time.perf_counter() - start)
+
+
+class Connection(sqlite3.Connection):
+	""" the sqlite3 factory db.connect() uses when metrics are on. sqlite3's own
+	con.execute() and friends make their cursor in C without calling cursor(), so they're
+	overridden to go through it and every statement ends up in Cursor """
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		req = getattr(_local, "request", None)
+		if req is not None:
+			req.opened += 1
+		else:
+			with _lock:
+				_opened[("", "")] += 1
+
+	def cursor(self, factory=Cursor):
+		return super().cursor(factory)
+
+	def execute(self, sql, parameters=()):
+		return self.cursor().execute(sql, parameters)
+
+	def executemany(self, sql, parameters):
+		return self.cursor().executemany(sql, parameters)
+
+	def executescript(self, sql):
+		return self.cursor().executescript(sql)
+
+
+def _record(sql, elapsed):
+	req = getattr(_local, "request", None)
+	if req is None:
+		return
+	req.sql_time += elapsed
+	if sql is not None:
+		req.queries += 1
+		req.statements[sql] += 1
+
+
+def start_request():
+	_local.request = _Request()
+
+
+def finish_request(method: str, route: str, status: int, size: int = None):
+	""" file what the request on this thread did under its route (the url rule, so
+	/api/event/<id> rather than every id) """
+	req = getattr(_local, "request", None)
+	if req is None:
+		return
+	_local.request = None
+	elapsed = time.perf_counter() - req.start
+	key = (route, method)
+	repeated = None
+	if req.statements:
+		sql, times = req.statements.most_common(1)[0]
+		if times > N_PLUS_ONE:
+			repeated = (sql, times)
+	with _lock:
+		_latency[key].observe(elapsed)
+		if size is not None:
+			_sizes[key].observe(size)
+		_queries[key].observe(req.queries)
+		_sql_time[key] += req.sql_time
+		if req.opened:
+			_opened[key] += req.opened
+		_requests[key + (str(status),)] += 1
+		if repeated is not None:
+			_n_plus_one[key] += 1
+	if repeated is not None:
+		logging.warning("%s %s ran the same statement %d times (N+1?): %s", method, route, repeated[1], " ".join(repeated[0].split()))
+
+
+def _labels(**labels) -> str:
+	escaped = (name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+		for name, value in labels.items())
+	return "{" + ",".join(escaped) + "}"
+
+
+def _histogram(lines, name: str, help: str, histograms: dict):
+	lines.append(f"# HELP {name} {help}")
+	lines.append(f"# TYPE {name} histogram")
+	for (route, method), histogram in sorted(histograms.items()):
+		total = 0
+		for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+			total += count
+			lines.append(f"{name}_bucket{_labels(route=route, method=method, le=bound)} {total}")
+		lines.append(f"{name}_sum{_labels(route=route, method=method)} {histogram.sum}")
+		lines.append(f"{name}_count{_labels(route=route, method=method)} {histogram.count}")
+
+
+def render() -> str:
+	""" everything so far in prometheus' text format """
+	lines = []
+	with _lock:
+		lines.append("# HELP http_requests_total Requests handled, by route, method and status.")
+		lines.append("# TYPE http_requests_total counter")
+		for (route, method, status), count in sorted(_requests.items()):
+			lines.append(f"http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+		_histogram(lines, "http_request_duration_seconds", "Time spent in the view, including sql.", _latency)
+		_histogram(lines, "http_response_size_bytes", "Response body sizes, where the length is known up front.", _sizes)
+		_histogram(lines, "db_queries_per_request", "Statements executed per request.", _queries)
+		lines.append("# HELP db_query_seconds_total Time spent executing statements and fetching rows.")
+		lines.append("# TYPE db_query_seconds_total counter")
+		for (route, method), seconds in sorted(_sql_time.items()):
+			lines.append(f"db_query_seconds_total{_labels(route=route, method=method)} {seconds}")
+		lines.append(f"# HELP db_n_plus_one_total Requests that ran one statement more than {N_PLUS_ONE} times.")
+		lines.append("# TYPE db_n_plus_one_total counter")
+		for (route, method), count in sorted(_n_plus_one.items()):
+			lines.append(f"db_n_plus_one_total{_labels(route=route, method=method)} {count}")
+		lines.append("# HELP db_connections_opened_total New sqlite connections, by the route that needed them (the pool reuses them).")
+		lines.append("# TYPE db_connections_opened_total counter")
+		for (route, method), count in sorted(_opened.items()):
+			lines.append(f"db_connections_opened_total{_labels(route=route, method=method)} {count}")
+	lines.append("# HELP cache_hits_total Lookups answered from the in-process cache.")
+	lines.append("# TYPE cache_hits_total counter")
+	stats = cache.stats()
+	for name, cache_stats in sorted(stats.items()):
+		lines.append(f"cache_hits_total{_labels(cache=name)} {cache_stats['hits']}")
+	lines.append("# HELP cache_misses_total Lookups that went to the database.")
+	lines.append("# TYPE cache_misses_total counter")
+	for name, cache_stats in sorted(stats.items()):
+		lines.append(f"cache_misses_total{_labels(cache=name)} {cache_stats['misses']}")
+	return "\n".join(lines) + "\n"
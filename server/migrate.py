@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+applies the numbered files in migrations/ in order. the schema version is kept in
+PRAGMA user_version: a database at version N has had migrations 000 .. N-1 applied.
+
+    python migrate.py [path/to/data.db]
+"""
+import glob
+import os
+import re
+import sqlite3
+import sys
+
+import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# databases made before this runner existed had 000 and 001 applied by hand
+LEGACY_VERSION = 2
+
+
+def migrations():
+	""" [(number, path)] sorted by number """
+	found = []
+	for path in glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql")):
+		match = re.match(r"(\d+)", os.path.basename(path))
+		if match is not None:
+			found.append((int(match.group(1)), path))
+	return sorted(found)
+
+
+def version(con: sqlite3.Connection) -> int:
+	return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(con: sqlite3.Connection = None) -> int:
+	""" bring the database up to date, returns the new version """
+	if con is None:
+		con = db.get_db()
+	current = version(con)
+	if current == 0 and con.execute("SELECT 1 FROM sqlite_master WHERE name = 'users'").fetchone():
+		current = LEGACY_VERSION
+
+	for number, path in migrations():
+		if number < current:
+			continue
+		with open(path) as f:
+			script = f.read()
+		# executescript commits whatever is pending, so do the BEGIN/COMMIT ourselves
+		# so a failing migration doesn't leave the schema half applied
+		try:
+			con.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number + 1};\nCOMMIT;")
+		except sqlite3.Error:
+			if con.in_transaction:
+				con.rollback()
+			raise
+		current = number + 1
+	return current
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		db.set_db_path(sys.argv[1])
+	print(f"{db.DB_PATH} is at version {migrate()}")
@@ -0,0 +1,2 @@
+-- users.pfp defaults to 0, so with foreign_keys on there has to be a pfp 0
+INSERT OR IGNORE INTO pfps (id, data) VALUES (0, X'');
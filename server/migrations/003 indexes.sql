@@ -0,0 +1,18 @@
+-- collapse any duplicate invites before enforcing (events, name) uniqueness
+DELETE FROM eventCollab WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM eventCollab GROUP BY events, name
+);
+
+CREATE UNIQUE INDEX eventCollab_events_name ON eventCollab (events, name);
+CREATE INDEX eventCollab_events_accepted ON eventCollab (events, accepted, name);
+CREATE INDEX eventCollab_name_accepted ON eventCollab (name, accepted, events);
+
+CREATE INDEX events_owner ON events (owner);
+
+CREATE INDEX photos_eventid ON photos (eventid);
+
+CREATE INDEX friends_username1 ON friends (username1, username2);
+CREATE INDEX friends_username2 ON friends (username2, username1);
+
+-- foreign key checks on pfps look up the users pointing at them
+CREATE INDEX users_pfp ON users (pfp);
@@ -0,0 +1,3 @@
+-- lets the dashboard page through a user's events in start order off the index
+DROP INDEX events_owner;
+CREATE INDEX events_owner_start ON events (owner, start);
@@ -0,0 +1,10 @@
+-- photo and pfp bytes move to files in the blob store (see blobs.py), keyed by sha256.
+-- rows that still have their bytes in photo/data have a NULL hash until move_blobs.py
+-- (or the first read) moves them out, after which the old column is left empty
+ALTER TABLE photos ADD COLUMN hash TEXT;
+ALTER TABLE photos ADD COLUMN size INTEGER;
+CREATE INDEX photos_hash ON photos (hash);
+
+ALTER TABLE pfps ADD COLUMN hash TEXT;
+ALTER TABLE pfps ADD COLUMN size INTEGER;
+CREATE INDEX pfps_hash ON pfps (hash);
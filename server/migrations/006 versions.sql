@@ -0,0 +1,3 @@
+-- bumped on every update, used for the ETags of /api/user/<username> and /api/event/<id>
+ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE events ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
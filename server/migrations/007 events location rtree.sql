@@ -0,0 +1,25 @@
+-- spatial index over where events are, for /api/events/nearby. kept in sync by triggers so
+-- cascaded deletes (eg. when the owner is deleted) are covered too
+CREATE VIRTUAL TABLE events_location USING rtree(
+    id,
+    min_lat, max_lat,
+    min_lon, max_lon
+);
+
+INSERT INTO events_location (id, min_lat, max_lat, min_lon, max_lon)
+    SELECT id, location_lat, location_lat, location_lon, location_lon FROM events;
+
+CREATE TRIGGER events_location_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_location (id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (NEW.id, NEW.location_lat, NEW.location_lat, NEW.location_lon, NEW.location_lon);
+END;
+
+CREATE TRIGGER events_location_update AFTER UPDATE OF location_lat, location_lon ON events BEGIN
+    UPDATE events_location SET min_lat = NEW.location_lat, max_lat = NEW.location_lat,
+        min_lon = NEW.location_lon, max_lon = NEW.location_lon
+        WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER events_location_delete AFTER DELETE ON events BEGIN
+    DELETE FROM events_location WHERE id = OLD.id;
+END;
@@ -0,0 +1,2 @@
+-- calendar queries look for a user's events with end > from AND start < to
+CREATE INDEX events_owner_end ON events (owner, end, start);
@@ -0,0 +1,42 @@
+-- full text search for /api/search, with prefix indexes for typeahead. both tables are
+-- external content tables kept in sync by triggers
+CREATE VIRTUAL TABLE users_fts USING fts5(
+    username, name, bio,
+    content = 'users',
+    prefix = '1 2 3'
+);
+INSERT INTO users_fts (users_fts) VALUES ('rebuild');
+
+CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts (rowid, username, name, bio) VALUES (NEW.rowid, NEW.username, NEW.name, NEW.bio);
+END;
+
+CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username, name, bio) VALUES ('delete', OLD.rowid, OLD.username, OLD.name, OLD.bio);
+END;
+
+CREATE TRIGGER users_fts_update AFTER UPDATE OF username, name, bio ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username, name, bio) VALUES ('delete', OLD.rowid, OLD.username, OLD.name, OLD.bio);
+    INSERT INTO users_fts (rowid, username, name, bio) VALUES (NEW.rowid, NEW.username, NEW.name, NEW.bio);
+END;
+
+CREATE VIRTUAL TABLE events_fts USING fts5(
+    eventName,
+    content = 'events',
+    content_rowid = 'id',
+    prefix = '1 2 3'
+);
+INSERT INTO events_fts (events_fts) VALUES ('rebuild');
+
+CREATE TRIGGER events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts (rowid, eventName) VALUES (NEW.id, NEW.eventName);
+END;
+
+CREATE TRIGGER events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, eventName) VALUES ('delete', OLD.id, OLD.eventName);
+END;
+
+CREATE TRIGGER events_fts_update AFTER UPDATE OF eventName ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, eventName) VALUES ('delete', OLD.id, OLD.eventName);
+    INSERT INTO events_fts (rowid, eventName) VALUES (NEW.id, NEW.eventName);
+END;
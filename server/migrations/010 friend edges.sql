@@ -0,0 +1,24 @@
+-- every friendship (or request) is stored once in each direction, so "who is X friends
+-- with" is a prefix scan of the primary key whichever side X is on.
+-- status is from username's point of view: 'requested' (username asked friend),
+-- 'incoming' (friend asked username) or 'friends'
+CREATE TABLE friendEdges (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    friend TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    status TEXT NOT NULL CHECK (status IN ('requested', 'incoming', 'friends')),
+    PRIMARY KEY (username, friend)
+) WITHOUT ROWID;
+
+-- for the cascade when friend is deleted
+CREATE INDEX friendEdges_friend ON friendEdges (friend);
+
+INSERT OR IGNORE INTO friendEdges (username, friend, status)
+    SELECT username1, username2, 'friends' FROM friends
+    WHERE username1 IS NOT NULL AND username2 IS NOT NULL AND username1 != username2
+        AND username1 IN (SELECT username FROM users) AND username2 IN (SELECT username FROM users)
+    UNION
+    SELECT username2, username1, 'friends' FROM friends
+    WHERE username1 IS NOT NULL AND username2 IS NOT NULL AND username1 != username2
+        AND username1 IN (SELECT username FROM users) AND username2 IN (SELECT username FROM users);
+
+DROP TABLE friends;
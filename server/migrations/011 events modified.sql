@@ -0,0 +1,63 @@
+-- modification times for the calendar feed's sync tokens (/api/user/<username>/calendar.ics?since=).
+-- they come off one clock that only goes forwards: the time in ms, or one past its last
+-- value if that's later. writes take turns, so a reader that has seen clock = N has seen
+-- every change stamped N or less, and a token of N can't miss one that commits later
+CREATE TABLE syncState (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    clock INTEGER NOT NULL,
+    -- removals stamped before this have been forgotten (maintenance.py), older tokens get a 410
+    pruned INTEGER NOT NULL
+);
+INSERT INTO syncState (id, clock, pruned) VALUES (0, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER), 0);
+UPDATE syncState SET pruned = clock;
+
+ALTER TABLE events ADD COLUMN modified INTEGER NOT NULL DEFAULT 0;
+UPDATE events SET modified = (SELECT clock FROM syncState);
+CREATE INDEX events_owner_modified ON events (owner, modified);
+
+-- events that left someone's calendar (deleted, given to another owner, or left), so a
+-- sync can tell them to drop it. rows for events that are back in that calendar are ignored
+CREATE TABLE eventsRemoved (
+    username TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    modified INTEGER NOT NULL,
+    PRIMARY KEY (username, id)
+);
+CREATE INDEX eventsRemoved_modified ON eventsRemoved (modified);
+
+-- triggers rather than the python side so cascades (eg. when the owner is deleted) count too
+CREATE TRIGGER events_modified_insert AFTER INSERT ON events BEGIN
+    UPDATE syncState SET clock = MAX(clock + 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+    UPDATE events SET modified = (SELECT clock FROM syncState) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER events_modified_update AFTER UPDATE OF eventName, owner, start, end, location_lat, location_lon ON events BEGIN
+    UPDATE syncState SET clock = MAX(clock + 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+    UPDATE events SET modified = (SELECT clock FROM syncState) WHERE id = NEW.id;
+    INSERT OR REPLACE INTO eventsRemoved (username, id, modified)
+        SELECT OLD.owner, OLD.id, clock FROM syncState WHERE OLD.owner != NEW.owner;
+END;
+
+CREATE TRIGGER events_modified_delete AFTER DELETE ON events BEGIN
+    UPDATE syncState SET clock = MAX(clock + 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+    INSERT OR REPLACE INTO eventsRemoved (username, id, modified)
+        SELECT OLD.owner, OLD.id, clock FROM syncState;
+END;
+
+-- accepting puts an event in the attendee's calendar. it's stamped as changed, which
+-- everyone else's next sync sends again too, but that's harmless
+CREATE TRIGGER eventCollab_modified_insert AFTER INSERT ON eventCollab WHEN NEW.accepted BEGIN
+    UPDATE syncState SET clock = MAX(clock + 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+    UPDATE events SET modified = (SELECT clock FROM syncState) WHERE id = NEW.events;
+END;
+
+CREATE TRIGGER eventCollab_modified_accept AFTER UPDATE OF accepted ON eventCollab WHEN NEW.accepted AND NOT OLD.accepted BEGIN
+    UPDATE syncState SET clock = MAX(clock + 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+    UPDATE events SET modified = (SELECT clock FROM syncState) WHERE id = NEW.events;
+END;
+
+CREATE TRIGGER eventCollab_modified_delete AFTER DELETE ON eventCollab WHEN OLD.accepted BEGIN
+    UPDATE syncState SET clock = MAX(clock + 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+    INSERT OR REPLACE INTO eventsRemoved (username, id, modified)
+        SELECT OLD.name, OLD.events, clock FROM syncState;
+END;
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+one-shot move of photo and pfp bytes that are still stored in the database into the
+blob store. safe to re-run, and to run while the server is up
+
+    python move_blobs.py [--vacuum] [path/to/data.db]
+
+--vacuum gives the freed pages back to the filesystem afterwards (this locks the
+database while it runs)
+"""
+import sys
+
+import db
+from events import Events
+from migrate import migrate
+from user import UsersSlay
+
+BATCH = 100
+
+
+def move(select: str, move_out) -> (int, int):
+	""" move every row select finds, BATCH at a time. returns (rows, bytes) moved """
+	rows = size = 0
+	while True:
+		with db.get_db() as con:
+			batch = con.execute(select, [BATCH]).fetchall()
+		if not batch:
+			return rows, size
+		for id, length in batch:
+			move_out(id)
+			rows += 1
+			size += length
+
+
+def main(args):
+	vacuum = "--vacuum" in args
+	args = [arg for arg in args if arg != "--vacuum"]
+	if args:
+		db.set_db_path(args[0])
+	migrate()
+
+	rows, size = move("SELECT id, length(photo) FROM photos WHERE hash IS NULL LIMIT ?", Events.move_photo_out)
+	print(f"moved {rows} photos ({size} bytes)")
+	rows, size = move("SELECT id, length(data) FROM pfps WHERE hash IS NULL LIMIT ?", UsersSlay.move_pfp_out)
+	print(f"moved {rows} pfps ({size} bytes)")
+
+	if vacuum:
+		db.get_db().execute("VACUUM")
+		print("vacuumed")
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+# bcrypt work factor for new hashes. existing hashes with a different cost are
+# redone the next time their owner logs in
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+# processes doing the hashing. 0 hashes on the calling thread instead
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", str(os.cpu_count() or 1)))
+# hashes allowed to be running or waiting at once before we start turning logins away
+HASH_QUEUE = int(os.environ.get("HASH_QUEUE", str(HASH_WORKERS * 4)))
+# give up waiting for a hash after this many seconds
+HASH_TIMEOUT = float(os.environ.get("HASH_TIMEOUT", "10"))
+
+
+class Overloaded(Exception):
+	""" too many hashes queued already, try again later """
+
+
+_executor = None
+_slots = threading.BoundedSemaphore(HASH_QUEUE)
+_lock = threading.Lock()
+
+
+def _run(fn, *args):
+	""" run fn in the hashing pool, or raise Overloaded right away if the queue is full """
+	if HASH_WORKERS <= 0:
+		return fn(*args)
+	global _executor
+	if not _slots.acquire(blocking=False):
+		raise Overloaded()
+	try:
+		with _lock:
+			if _executor is None:
+				_executor = ProcessPoolExecutor(HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+			future = _executor.submit(fn, *args)
+	except BaseException:
+		_slots.release()
+		raise
+	# the slot is the job's, not the caller's: a hash we gave up waiting on is still queued
+	# or running, and releasing on the timeout would let HASH_QUEUE more pile up behind it
+	future.add_done_callback(lambda future: _slots.release())
+	try:
+		return future.result(HASH_TIMEOUT)
+	except TimeoutError:
+		raise Overloaded()
+
+
+def shutdown():
+	""" stop the pool and wait for its processes to exit. it starts again if it's needed """
+	global _executor
+	with _lock:
+		executor, _executor = _executor, None
+	if executor is not None:
+		executor.shutdown(wait=True)
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+	return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def hash(password: str) -> bytes:
+	return _run(_hash, password.encode(), BCRYPT_ROUNDS)
+
+
+def check(password: str, hashed: bytes) -> bool:
+	return _run(bcrypt.checkpw, password.encode(), hashed)
+
+
+def needs_rehash(hashed: bytes) -> bool:
+	""" whether the hash was made with a different work factor than BCRYPT_ROUNDS """
+	# $2b$12$<salt + hash>
+	try:
+		return int(hashed.split(b"$")[2]) != BCRYPT_ROUNDS
+	except (IndexError, ValueError):
+		return True
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+# messages a subscriber can fall behind by before it gets cut off (it reconnects and refetches)
+SUBSCRIBER_QUEUE = int(os.environ.get("SUBSCRIBER_QUEUE", "64"))
+# seconds between keepalive comments on an idle stream
+HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
+# streams are closed after this many seconds so dead clients can't pile up; EventSource reconnects
+STREAM_TIMEOUT = float(os.environ.get("SSE_TIMEOUT", "300"))
+
+_topics = {}
+_lock = threading.Lock()
+# with several worker processes (serve.py), each one's datagram socket in a shared
+# directory. what's published in one is forwarded to the rest
+_peer = None
+_peer_sender = None
+_peer_dir = None
+# topic -> function called with messages from other processes, instead of handing them to subscribers
+_handlers = {}
+
+
+class Subscriber(object):
+
+	def __init__(self, topics):
+		self.topics = topics
+		self.queue = queue.Queue(SUBSCRIBER_QUEUE)
+		self.lagged = False
+		# set by close_all(), the stream ends (and the client reconnects, maybe elsewhere)
+		self.closed = False
+		# called after anything is queued, by streams waiting on an event loop
+		self.wake = None
+
+
+def user_topic(username: str) -> str:
+	return f"user:{username}"
+
+
+def event_topic(id) -> str:
+	return f"event:{id}"
+
+
+def subscribe(*topics) -> Subscriber:
+	subscriber = Subscriber(topics)
+	with _lock:
+		for topic in topics:
+			_topics.setdefault(topic, set()).add(subscriber)
+	return subscriber
+
+
+def unsubscribe(subscriber: Subscriber):
+	with _lock:
+		for topic in subscriber.topics:
+			subscribers = _topics.get(topic)
+			if subscribers is None:
+				continue
+			subscribers.discard(subscriber)
+			if not subscribers:
+				del _topics[topic]
+
+
+def publish(topic: str, message: dict):
+	""" send message to everyone subscribed to topic, in this process and (with peers
+	started) the others. never blocks: a subscriber whose queue is full is marked lagged
+	and dropped """
+	_deliver(topic, message)
+	forward(topic, message)
+
+
+def _deliver(topic: str, message: dict):
+	with _lock:
+		subscribers = list(_topics.get(topic, ()))
+	for subscriber in subscribers:
+		try:
+			subscriber.queue.put_nowait(message)
+		except queue.Full:
+			subscriber.lagged = True
+			unsubscribe(subscriber)
+		if subscriber.wake is not None:
+			subscriber.wake()
+
+
+def close_all():
+	""" end every open stream, eg. so a worker that's shutting down isn't kept up by them """
+	with _lock:
+		subscribers = {subscriber for subscribers in _topics.values() for subscriber in subscribers}
+	for subscriber in subscribers:
+		subscriber.closed = True
+		if subscriber.wake is not None:
+			subscriber.wake()
+
+
+def start_peer(directory: str, handlers: dict = None):
+	""" join the other processes with a socket in directory: from now on publish() reaches
+	their subscribers too, and theirs reach ours. handlers maps topics that aren't for
+	subscribers to a function to call with each message from the others instead """
+	global _peer, _peer_sender, _peer_dir
+	_handlers.update(handlers or {})
+	_peer_dir = directory
+	_peer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+	_peer.bind(os.path.join(directory, str(os.getpid())))
+	# publish() must never wait on another process
+	_peer_sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+	_peer_sender.setblocking(False)
+	threading.Thread(target=_receive, name="pubsub-peer", daemon=True).start()
+
+
+def forward(topic: str, message: dict):
+	""" send message to the other processes only. datagrams to a peer whose buffer is full
+	are dropped, like a lagged subscriber's """
+	if _peer is None:
+		return
+	data = json.dumps([topic, message]).encode()
+	me = os.path.basename(_peer.getsockname())
+	for name in os.listdir(_peer_dir):
+		if name == me:
+			continue
+		try:
+			_peer_sender.sendto(data, os.path.join(_peer_dir, name))
+		except (BlockingIOError, ConnectionRefusedError, FileNotFoundError):
+			# busy, or a worker that just exited
+			pass
+		except OSError as e:
+			logging.warning("couldn't forward %s to %s: %s", topic, name, e)
+
+
+def _receive():
+	while True:
+		topic, message = json.loads(_peer.recv(65536))
+		try:
+			handler = _handlers.get(topic)
+			if handler is not None:
+				handler(message)
+			else:
+				_deliver(topic, message)
+		except Exception:
+			logging.exception("couldn't handle %s from another process", topic)
+
+
+class Stream(object):
+	""" the text/event-stream body for a subscriber, as bytes. it can be iterated normally
+	(wsgi) or with async for (asgi.py), and unsubscribes when it ends either way """
+
+	def __init__(self, subscriber: Subscriber):
+		self.subscriber = subscriber
+
+	def __iter__(self):
+		subscriber = self.subscriber
+		deadline = time.monotonic() + STREAM_TIMEOUT
+		try:
+			yield b"retry: 3000\n\n"
+			while time.monotonic() < deadline and not subscriber.lagged and not subscriber.closed:
+				try:
+					message = subscriber.queue.get(timeout=min(HEARTBEAT, max(0, deadline - time.monotonic())))
+				except queue.Empty:
+					yield b": heartbeat\n\n"
+					continue
+				yield _format(message)
+		finally:
+			unsubscribe(subscriber)
+
+	async def __aiter__(self):
+		# same as __iter__, but waits on the event loop instead of holding a thread
+		subscriber = self.subscriber
+		loop = asyncio.get_running_loop()
+		ready = asyncio.Event()
+		subscriber.wake = lambda: loop.call_soon_threadsafe(ready.set)
+		deadline = time.monotonic() + STREAM_TIMEOUT
+		try:
+			yield b"retry: 3000\n\n"
+			while time.monotonic() < deadline and not subscriber.lagged and not subscriber.closed:
+				ready.clear()
+				try:
+					message = subscriber.queue.get_nowait()
+				except queue.Empty:
+					try:
+						await asyncio.wait_for(ready.wait(), min(HEARTBEAT, max(0, deadline - time.monotonic())))
+					except asyncio.TimeoutError:
+						yield b": heartbeat\n\n"
+					continue
+				yield _format(message)
+		finally:
+			unsubscribe(subscriber)
+
+
+def _format(message: dict) -> bytes:
+	return f"event: {message['type']}\ndata: {json.dumps(message)}\n\n".encode()
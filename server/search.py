@@ -0,0 +1,73 @@
+import heapq
+import re
+
+from db import get_db
+from events import Events
+
+# words people type, everything else (quotes, operators, ...) is dropped
+WORD = re.compile(r"\w+", re.UNICODE)
+
+# only this many matches get ranked, per pass. ranking is the slow part, and a short
+# prefix (or a common word, like one that's in a lot of bios) can match a big chunk of the
+# table; past this the query is too vague for the order to matter much anyway. whole word
+# matches get a pass of their own ahead of prefix matches, and a username typed out in
+# full is looked up directly, so an exact hit isn't crowded out by the rest
+RANK_CANDIDATES = 500
+
+
+def match_query(text: str, prefix: bool = True):
+	""" an fts5 MATCH expression where every word has to match (as a prefix, unless prefix
+	is False), or None if there are no words """
+	words = WORD.findall(text)
+	if not words:
+		return None
+	star = "*" if prefix else ""
+	return " ".join(f'"{word}"{star}' for word in words)
+
+
+def _best(rows, candidates, limit: int):
+	""" rows, then the best of candidates that aren't among them, up to limit. rows start
+	with their key and end with their bm25 """
+	seen = {row[0] for row in rows}
+	rest = (row for row in candidates if row[0] not in seen)
+	return rows + heapq.nsmallest(limit - len(rows), rest, key=lambda row: row[-1])
+
+
+def users(text: str, limit: int = 10):
+	""" users whose username, name or bio match text, best first """
+	query = match_query(text)
+	if query is None:
+		return []
+	with get_db() as con:
+		cur = con.cursor()
+		cur.execute("SELECT users.username, users.name, users.pronouns, users.pfp, 0 FROM users WHERE users.username = ?",
+			[text.strip()])
+		rows = cur.fetchall()
+		for match in (match_query(text, prefix=False), query):
+			if len(rows) >= limit:
+				break
+			# usernames count the most, then names, then bios
+			cur.execute("SELECT users.username, users.name, users.pronouns, users.pfp, bm25(users_fts, 10.0, 5.0, 1.0) FROM users_fts JOIN users ON users.rowid = users_fts.rowid WHERE users_fts MATCH ? LIMIT ?",
+				[match, RANK_CANDIDATES])
+			rows = _best(rows, cur.fetchall(), limit)
+	return [
+		{'username': username, 'name': name, 'pronouns': pronouns, 'pfp_id': pfp_id}
+		for username, name, pronouns, pfp_id, _ in rows
+	]
+
+
+def events(text: str, limit: int = 10):
+	""" events whose name matches text, best first """
+	query = match_query(text)
+	if query is None:
+		return []
+	rows = []
+	with get_db() as con:
+		cur = con.cursor()
+		for match in (match_query(text, prefix=False), query):
+			if len(rows) >= limit:
+				break
+			cur.execute("SELECT events.id, events.eventName, events.owner, events.start, events.end, events.location_lat, events.location_lon, events.version, bm25(events_fts) FROM events_fts JOIN events ON events.id = events_fts.rowid WHERE events_fts MATCH ? LIMIT ?",
+				[match, RANK_CANDIDATES])
+			rows = _best(rows, cur.fetchall(), limit)
+	return [Events(*row[:-1]) for row in rows]
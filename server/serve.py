@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+production launcher: binds the port, brings the database up to date, then forks WORKERS
+processes that each serve asgi.py under uvicorn from the shared socket. they share one
+WAL-mode database; what one publishes to event streams or invalidates in its cache is
+forwarded to the others (pubsub.start_peer)
+
+    SECRET_KEY=... python serve.py [--workers N] [--host HOST] [--port PORT]
+
+a worker opens its connections, compiles the hot selects and loads the page and its
+scripts before it starts accepting. SIGTERM (or ^C) stops accepting, lets requests in
+flight, uploads included, finish for up to GRACEFUL_TIMEOUT seconds and ends event
+streams so their clients reconnect elsewhere. a worker that dies is replaced
+"""
+import argparse
+import ast
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import db
+from migrate import migrate
+
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", "8000"))
+WORKERS = int(os.environ.get("WORKERS", str(os.cpu_count() or 1)))
+# seconds a stopping worker waits for requests in flight before cutting them off
+GRACEFUL_TIMEOUT = float(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+BACKLOG = 2048
+
+SERVER = os.path.dirname(os.path.abspath(__file__))
+# modules whose selects get compiled on every pooled connection before a worker starts
+HOT_MODULES = ["app.py", "events.py", "user.py", "search.py", "Friends.py"]
+# fetched once through the app before a worker starts, so the first real ones aren't slow
+WARM_PATHS = ["/", "/public/app.js", "/public/planner.js"]
+
+
+def hot_statements() -> list:
+	""" every select written out in HOT_MODULES """
+	statements = []
+	for module in HOT_MODULES:
+		with open(os.path.join(SERVER, module)) as f:
+			tree = ast.parse(f.read(), module)
+		statements += [
+			node.value for node in ast.walk(tree)
+			if isinstance(node, ast.Constant) and isinstance(node.value, str) and node.value.lstrip()[:7].upper() == "SELECT "
+		]
+	return statements
+
+
+def warm(app):
+	db.warm(hot_statements())
+	client = app.test_client()
+	for path in WARM_PATHS:
+		client.get(path)
+
+
+def worker(number: int, sock: socket.socket, peer_dir: str):
+	""" runs in the forked child, never returns """
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	signal.signal(signal.SIGINT, signal.SIG_DFL)
+	status = 1
+	try:
+		import cache
+		import maintenance
+		import pubsub
+		# one maintenance job is enough
+		if number != 0:
+			maintenance.MAINTENANCE_INTERVAL = 0
+		pubsub.start_peer(peer_dir, {"cache": lambda message: cache.dropped(message["cache"], message["key"])})
+		cache.on_invalidate = lambda name, key: pubsub.forward("cache", {"cache": name, "key": key})
+
+		import uvicorn
+		from app import app
+		from asgi import application
+		warm(app)
+
+		class Server(uvicorn.Server):
+
+			def handle_exit(self, sig, frame):
+				# streams never finish on their own, so they'd hold up the drain to the end
+				pubsub.close_all()
+				super().handle_exit(sig, frame)
+
+		config = uvicorn.Config(application, log_level=logging.getLevelName(logging.root.level).lower(),
+			timeout_graceful_shutdown=GRACEFUL_TIMEOUT, backlog=BACKLOG)
+		Server(config).run(sockets=[sock])
+		status = 0
+	except BaseException:
+		logging.exception("worker %d failed", number)
+	finally:
+		os._exit(status)
+
+
+def spawn(number: int, sock: socket.socket, peer_dir: str) -> int:
+	pid = os.fork()
+	if pid == 0:
+		worker(number, sock, peer_dir)
+	return pid
+
+
+def main():
+	parser = argparse.ArgumentParser(description="serve the app from several worker processes")
+	parser.add_argument("--workers", type=int, default=WORKERS)
+	parser.add_argument("--host", default=HOST)
+	parser.add_argument("--port", type=int, default=PORT)
+	parser.add_argument("--log-level", default="info")
+	args = parser.parse_args()
+	logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(process)d %(levelname)s %(message)s")
+
+	if not os.environ.get("SECRET_KEY"):
+		sys.exit("serve.py: set SECRET_KEY, every worker has to sign sessions with the same key")
+
+	# once, here, rather than in every worker at the same time. no connection can be open
+	# across the fork
+	migrate()
+	db.close_all()
+
+	sock = listen(args.host, args.port)
+	peer_dir = tempfile.mkdtemp(prefix="planner-peers-")
+	workers = {spawn(number, sock, peer_dir): number for number in range(args.workers)}
+	host, port = sock.getsockname()[:2]
+	logging.info("listening on http://%s:%d with %d workers", host, port, args.workers)
+
+	stopping = False
+
+	def stop(sig, frame):
+		nonlocal stopping
+		stopping = True
+		for pid in workers:
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+
+	try:
+		while workers and not stopping:
+			pid, status = os.wait()
+			number = workers.pop(pid, None)
+			_remove_peer(peer_dir, pid)
+			if number is None or stopping:
+				continue
+			logging.warning("worker %d (pid %d) exited with status %d, starting another", number, pid, os.waitstatus_to_exitcode(status))
+			# don't spin if it dies straight away every time
+			time.sleep(1)
+			workers[spawn(number, sock, peer_dir)] = number
+
+		deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+		while workers:
+			for pid in list(workers):
+				if os.waitpid(pid, os.WNOHANG)[0] != 0:
+					del workers[pid]
+			if time.monotonic() > deadline:
+				for pid in workers:
+					logging.warning("worker %d (pid %d) didn't stop in time, killing it", workers[pid], pid)
+					os.kill(pid, signal.SIGKILL)
+				deadline = float("inf")
+			time.sleep(0.1)
+	finally:
+		sock.close()
+		shutil.rmtree(peer_dir, ignore_errors=True)
+	logging.info("stopped")
+
+
+def listen(host: str, port: int) -> socket.socket:
+	# IPPROTO_TCP has to be explicit for asyncio to set TCP_NODELAY (see bench.listen)
+	family = socket.AF_INET6 if ":" in host else socket.AF_INET
+	sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind((host, port))
+	sock.listen(BACKLOG)
+	return sock
+
+
+def _remove_peer(peer_dir: str, pid: int):
+	try:
+		os.unlink(os.path.join(peer_dir, str(pid)))
+	except FileNotFoundError:
+		pass
+
+
+if __name__ == "__main__":
+	main()
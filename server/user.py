@@ -1,8 +1,13 @@
 from dataclasses import dataclass
 from db import get_db
+import blobs
+import images
+import cache
+from cache import TTLCache
+from Friends import Friends
 
 
-@dataclass
+@dataclass(slots=True)
 class UsersSlay(object):
 	username: str
 	password: bytes
@@ -14,69 +19,107 @@ class UsersSlay(object):
 	pfp_id: int
 	associations: str
 	job: str = "Student at UCSC"
+	version: int = 0
 	
 	@staticmethod
 	def get(username: str):
+		return _cache.get(username, lambda: UsersSlay.load(username))
+
+	@staticmethod
+	def load(username: str):
+		""" get, skipping the cache """
 		with get_db() as con:
 			cur = con.cursor()
-			cur.execute("SELECT * FROM users WHERE username = ?", [username])
+			cur.execute("SELECT username, password, name, pronouns, bio, age, year, pfp, version FROM users WHERE username = ?", [username])
 			res = cur.fetchone()
 			if res is not None:
-				return UsersSlay(*res, associations=None)
+				return UsersSlay(*res[:-1], associations=None, version=res[-1])
 		return None
 
-	def get_pfp(self):
+	@staticmethod
+	def get_pfp(pfp_id: int):
+		""" the blob hash of the pfp, or None if it doesn't exist """
 		with get_db() as con:
 			cur = con.cursor()
-			cur.execute("SELECT * FROM pfps WHERE id = ?", [self.pfp_id])
+			cur.execute("SELECT hash FROM pfps WHERE id = ?", [pfp_id])
 			res = cur.fetchone()
 			if res is None: return None
-		return res['data']
+			if res[0] is not None: return res[0]
+		return UsersSlay.move_pfp_out(pfp_id)
 
-	def get_friends(self):
+	@staticmethod
+	def move_pfp_out(pfp_id: int):
+		""" move a pfp still stored in the pfps.data column into the blob store """
 		with get_db() as con:
 			cur = con.cursor()
-			cur.execute("SELECT * FROM friends WHERE username1 = ?", [self.username])
+			cur.execute("SELECT data FROM pfps WHERE id = ?", [pfp_id])
+			data = cur.fetchone()[0]
+			hash = blobs.put(data)
+			cur.execute("UPDATE pfps SET data = X'', hash = ?, size = ? WHERE id = ?", [hash, len(data), pfp_id])
+		return hash
+
+	def get_friends(self):
+		return Friends.get(self.username)
 
 	def add_friend(self, other_username):
-		with get_db() as con:
-			con.execute("UPDATE friends SET username1 = ?, username2 = ?", [self.username, other_username])
+		return Friends.request(self.username, other_username)
 
-	@staticmethod
-	def delete_friend(other_username):
-		with get_db() as con:
-			con.execute("DELETE FROM friends WHERE username2 = ?", [other_username])
+	def delete_friend(self, other_username):
+		Friends.remove(self.username, other_username)
 
 	def create(self):
 		with get_db() as con:
 			con.execute("INSERT INTO users (username, password, name, pronouns, bio, age, year, pfp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (self.username, self.password, self.name, self.pronouns, self.bio, self.age, self.year, self.pfp_id))
+		_cache.invalidate(self.username)
 	
 	@staticmethod
 	def create_pfp(pfp: bytes):
+		return UsersSlay.create_pfp_blob(blobs.put(pfp), len(pfp))
+
+	@staticmethod
+	def create_pfp_blob(hash: str, size: int):
+		""" add a pfp that is already in the blob store """
 		with get_db() as con:
 			cur = con.cursor()
-			cur.execute("INSERT INTO pfps (data) VALUES (?) RETURNING id", (pfp))
+			cur.execute("INSERT INTO pfps (data, hash, size) VALUES (X'', ?, ?) RETURNING id", [hash, size])
 			res = cur.fetchone()
 			if res is None:
 				return 0
-		return res['id']
+		images.generate(hash)
+		return res[0]
 	
-	def update(self):
+	def set_pfp(self, hash: str, size: int):
+		""" add a pfp that is already in the blob store and make it this user's, in one
+		transaction so maintenance never sees the new pfp with nobody pointing at it. the
+		old one is left for maintenance to delete """
 		with get_db() as con:
-			con.execute("UPDATE users SET password = ?, name = ?, pronouns = ?, bio = ?, age = ?, year = ?, pfp = ? WHERE username = ?",
-					(self.password, self.name, self.pronouns, self.bio, self.age, self.year, self.pfp_id, self.username))
+			cur = con.cursor()
+			cur.execute("INSERT INTO pfps (data, hash, size) VALUES (X'', ?, ?) RETURNING id", [hash, size])
+			pfp_id = cur.fetchone()[0]
+			cur.execute("UPDATE users SET pfp = ?, version = version + 1 WHERE username = ?", [pfp_id, self.username])
+		self.pfp_id = pfp_id
+		self.version += 1
+		_cache.invalidate(self.username)
+		images.generate(hash)
 
-	@staticmethod
-	def update_pfp(pfp_id: int, pfp: bytes):
+	def update(self):
 		with get_db() as con:
-			con.execute("UPDATE pfps SET data = ? WHERE id = ?", (pfp, pfp_id))
+			con.execute("UPDATE users SET password = ?, name = ?, pronouns = ?, bio = ?, age = ?, year = ?, pfp = ?, version = version + 1 WHERE username = ?",
+					(self.password, self.name, self.pronouns, self.bio, self.age, self.year, self.pfp_id, self.username))
+		self.version += 1
+		_cache.invalidate(self.username)
 
 	def delete(self):
 		with get_db() as con:
-			con.execute("DELETE FROM users WHERE username = ?", (self.username))
+			con.execute("DELETE FROM users WHERE username = ?", [self.username])
+		_cache.invalidate(self.username)
+		# their events went with them (ON DELETE CASCADE)
+		cache.clear("events")
 	
 	@staticmethod
 	def delete_pfp(pfp_id: int):
 		with get_db() as con:
-			con.execute("DELETE FROM pfps WHERE id = ?", (pfp_id))
+			con.execute("DELETE FROM pfps WHERE id = ?", [pfp_id])
+
 
+_cache = TTLCache("users")